@@ -1,33 +1,62 @@
 import os
-import time
+import asyncio
 import logging
+import time
 from datetime import datetime
 from telegram import Update
-from telegram.ext import ApplicationBuilder, CommandHandler, ConversationHandler, MessageHandler, filters, ContextTypes
+from telegram.ext import (ApplicationBuilder, CommandHandler, ConversationHandler, MessageHandler, TypeHandler,
+                          filters, ContextTypes)
 from telegram.ext.filters import Text
+from telegram.error import BadRequest
 import json
-from src.export import export2xlsx
+from src.export import (check_format, export2xlsx, export_orders, parse_period, prebuilt_report, report_cache,
+                        report_store)
+from src.jobs import ExportQueue, ExportQueueFull, UserLimitExceeded
+from src import metrics
+from src.file_id_index import FileIdIndex
 from dotenv import load_dotenv
 from apscheduler.schedulers.background import BackgroundScheduler
 from src.g_collector import scheduled_clear_tables
+from src.rollup import ensure_rollup_schema, refresh_hourly_rollup, scheduled_rollup_check
+from src.report_cache import DEFAULT_FORMATS
+from src.writers import OUTPUT_FORMATS
+from src.updates import ChatOrderedUpdateProcessor
+from src import webhook
+from src import warmup
+from src.logs import RateLimitFilter, setup_logging
+from src.state_store import get_state_store
+from src.persistence import SharedConversationHandler, StatePersistence, flush_persistence, refresh_conversations
 
 # Состояния для ConversationHandler
 ST_POINT, END_POINT = range(2)
 LOGIN, PASSWORD = range(2)
 
+# Режимы экспорта: слово после диапазона в ответе на /export -> функция формирования файла
+EXPORT_MODES = {
+    "couriers": export2xlsx,  # Агрегат по курьерам в Excel (по умолчанию)
+    "detail": export_orders,  # Отдельные заказы в CSV
+}
+
 load_dotenv()
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    level=logging.INFO,  # Уровень логирования (можно изменить на DEBUG для более детализированных логов)
-    handlers=[
-        logging.FileHandler('bot.log'),  # Запись в файл 'bot.log'
-        logging.StreamHandler()  # Также вывод в консоль
-    ]
-)
+# Настройка логирования: запись в файл (JSON, с ротацией) и в консоль идет в фоновом потоке
+setup_logging()
 logger = logging.getLogger(__name__)
 
+# Входящие сообщения пишутся в лог выборочно, чтобы поток сообщений не заполнял его
+message_logger = logging.getLogger("bot.messages")
+message_logger.addFilter(RateLimitFilter(float(os.getenv("LOG_MESSAGES_PER_SECOND", "5")),
+                                         int(os.getenv("LOG_MESSAGES_BURST", "20"))))
+
+# Общее хранилище сессий, диалогов и заданий: процессы бота видят одно и то же состояние
+state_store = get_state_store()
+
+# Очередь заданий экспорта: тяжелая генерация отчетов выполняется вне цикла событий
+export_queue = ExportQueue.from_env(job_store=state_store)
+
+# file_id уже отправленных отчетов: повторная отправка того же содержимого идет без загрузки файла
+file_id_index = FileIdIndex(state_store)
+
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
@@ -131,18 +160,40 @@ async def target_file(update: Update, context: ContextTypes.DEFAULT_TYPE, file2e
     Returns:
         None
     """
-    file_path = os.path.join(os.getcwd(), 'data', file2exp)
     logger.info(f"Attempting to send file {file2exp} to user {update.message.chat_id}")
 
-    # Проверяем, существует ли файл
-    if os.path.exists(file_path):
+    # Проверяем по индексу хранилища, существует ли файл; пока идет отправка, файл не будет удален
+    async with report_store.in_use_async(file2exp) as file_path:
+        if report_store.lookup(file2exp) is None:
+            logger.error(f"File {file2exp} not found for user {update.message.chat_id}")
+            await update.message.reply_text('Файл не найден.')
+            return
+
+        # Если такой же файл уже отправлялся, пересылаем его по file_id без загрузки
+        file_id = await asyncio.to_thread(file_id_index.lookup, file2exp, file_path)
+        if file_id is not None:
+            try:
+                await update.message.reply_document(document=file_id)
+                metrics.inc("telegram_file_id_reused_total", help_text="Число отправок отчета по file_id")
+                logger.info(f"File {file2exp} sent to user {update.message.chat_id} by file_id")
+                return
+            except BadRequest as e:
+                logger.warning(f"Stored file_id for {file2exp} rejected, uploading again: {e}")
+                await asyncio.to_thread(file_id_index.invalidate, file2exp)
+
         # Отправляем файл пользователю
-        with open(file_path, 'rb') as file:
-            await update.message.reply_document(document=file)
+        try:
+            with open(file_path, 'rb') as file, metrics.timer("telegram_upload_seconds", "Время отправки файла"):
+                message = await update.message.reply_document(document=file)
+        except FileNotFoundError:
+            # Файл удален в обход хранилища
+            report_store.discard(file2exp)
+            logger.error(f"File {file2exp} disappeared before sending to user {update.message.chat_id}")
+            await update.message.reply_text('Файл не найден.')
+            return
+        if message is not None and message.document is not None:
+            await asyncio.to_thread(file_id_index.store, file2exp, file_path, message.document.file_id)
         logger.info(f"File {file2exp} successfully sent to user {update.message.chat_id}")
-    else:
-        logger.error(f"File {file2exp} not found for user {update.message.chat_id}")
-        await update.message.reply_text('Файл не найден.')
 
 
 async def export(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -158,7 +209,12 @@ async def export(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """
     if context.user_data.get("authenticated"):  # Проверяем, авторизован ли пользователь
         logger.info(f"User {update.message.chat_id} initiated export process.")
-        await update.message.reply_text('Укажи диапазон в формате "st_p-end_p", например: 14-17')
+        await update.message.reply_text('Укажи диапазон в формате "st_p-end_p", например: 14-17. '
+                                        'Можно указать день: 2024-10-01 14-17, или несколько дней: '
+                                        '2024-10-01..2024-10-31 либо 2024-10-01 08..2024-10-07 20. '
+                                        'Для выгрузки отдельных заказов добавь "detail": 14-17 detail. '
+                                        'Формат файла (xlsx, csv, csv.gz, csv.zst, parquet или auto) '
+                                        'указывается в конце: 14-17 detail csv.gz')
         return ST_POINT  # Переходим к состоянию для обработки диапазона
     else:
         logger.warning(f"Unauthorized access attempt by user {update.message.chat_id}")
@@ -168,7 +224,10 @@ async def export(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 async def get_st_and_end_points(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """
-    Получает диапазон от пользователя и генерирует файл с данными.
+    Получает диапазон (часы текущего дня или произвольный период из нескольких дней, см. parse_period)
+    и ставит задание на формирование файла в очередь.
+
+    Обработчик не ждет генерации: файл отправляется пользователю, когда задание завершится.
 
     Args:
         update (Update): Объект обновления, содержащий информацию о сообщении.
@@ -178,38 +237,103 @@ async def get_st_and_end_points(update: Update, context: ContextTypes.DEFAULT_TY
         int: Завершение разговора или повторный запрос диапазона в случае ошибки.
     """
     try:
-        # Получаем сообщение от пользователя и парсим его
+        # Получаем сообщение от пользователя и парсим его; последние слова могут задавать режим и формат файла
         user_input = update.message.text.strip()
-        if "-" not in user_input:
-            raise ValueError("Диапазон должен быть в формате 'st_p-end_p'.")
+        mode, fmt = "couriers", None
+        for _ in range(2):
+            head, _, last_word = user_input.rpartition(" ")
+            if last_word.lower() in EXPORT_MODES:
+                user_input, mode = head, last_word.lower()
+            elif last_word.lower() in OUTPUT_FORMATS or last_word.lower() == "auto":
+                user_input, fmt = head, last_word.lower()
+        fmt = fmt or DEFAULT_FORMATS[mode]
+        check_format(fmt)
+
+        period_start, period_end = parse_period(user_input)
+        context.user_data['period'] = user_input
+    except ValueError as e:
+        logger.error(f"Invalid input from user {update.message.chat_id}: {e}")
+        await update.message.reply_text(f'Ошибка: {e} Попробуй снова указать диапазон, например: 14-17.')
+        return ST_POINT  # Если ошибка, просим пользователя ввести диапазон снова
 
-        st_point, end_point = map(int, user_input.split("-"))  # Разделяем и конвертируем в числа
-        if st_point >= end_point:
-            raise ValueError("Начало периода должно быть меньше конца периода.")
+    report_name = f"{period_start:%Y-%m-%d %H:%M} – {period_end:%Y-%m-%d %H:%M} ({mode}, {fmt})"
 
-        context.user_data['st_point'] = st_point
-        context.user_data['end_point'] = end_point
+    # Закрытый период, файл которого уже готов (например, подготовлен заранее), отправляем сразу, без очереди
+    file_name = prebuilt_report(period_start, period_end, kind=mode, fmt=fmt)
+    warmup.record_request(period_start, period_end, file_name is not None)
+    if file_name is not None:
+        logger.info(f"Report {report_name} for user {update.message.chat_id} served from a prebuilt file")
+        await target_file(update, context, file_name)
+        return ConversationHandler.END
 
-        # Формируем имя файла
-        file_name = f"courier_data_{st_point}-{end_point}.xlsx"
+    async def on_done(file_name, error):
+        # Вызывается очередью после завершения задания
+        if error is not None:
+            logger.error(f"Export of {report_name} for user {update.message.chat_id} failed: {error}")
+            await update.message.reply_text('Не удалось сформировать файл, попробуй позже.')
+        else:
+            logger.info(f"Report cache stats: {report_cache.stats()}")
+            await target_file(update, context, file_name)
 
-        # Отправляем сообщение о процессе формирования файла
-        logger.info(f"Generating file {file_name} for user {update.message.chat_id}")
-        await update.message.reply_text(f'Формирую файл: {file_name}')
-        export2xlsx(file_name, st_point, end_point)
-        time.sleep(5)
-        await target_file(update, context, file_name)
+    try:
+        position = export_queue.submit(update.message.chat_id, EXPORT_MODES[mode], (period_start, period_end, fmt),
+                                       on_done)
+    except UserLimitExceeded:
+        logger.warning(f"User {update.message.chat_id} exceeded export limit")
+        await update.message.reply_text('Дождись завершения предыдущего экспорта.')
+        return ConversationHandler.END
+    except ExportQueueFull:
+        logger.warning(f"Export queue is full, request from user {update.message.chat_id} rejected")
+        await update.message.reply_text('Очередь экспорта заполнена, попробуй позже.')
+        return ConversationHandler.END
 
-        return ConversationHandler.END  # Завершаем разговор
-    except ValueError as e:
-        logger.error(f"Invalid input from user {update.message.chat_id}: {e}")
-        await update.message.reply_text(f'Ошибка: {e}. Попробуй снова указать диапазон в формате "st_p-end_p".')
-        return ST_POINT  # Если ошибка, просим пользователя ввести диапазон снова
+    if position == 0:
+        logger.info(f"Report {report_name} for user {update.message.chat_id} joined an in-flight job")
+        await update.message.reply_text(f'Отчет за {report_name} уже формируется, пришлю его, как только будет готов.')
+        return ConversationHandler.END
+
+    # Отправляем сообщение о процессе формирования файла
+    logger.info(f"Queued report {report_name} for user {update.message.chat_id}, position {position}")
+    await update.message.reply_text(f'Формирую отчет за {report_name}. Заданий в очереди: {position}, '
+                                    f'выполняется: {export_queue.running}')
+    return ConversationHandler.END  # Завершаем разговор, файл придет после завершения задания
+
+
+def is_admin(chat_id) -> bool:
+    """Проверяет, входит ли чат в список администраторов из переменной окружения ADMIN_IDS."""
+    admin_ids = {item.strip() for item in os.getenv("ADMIN_IDS", "").split(",") if item.strip()}
+    return str(chat_id) in admin_ids
+
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Обрабатывает команду '/stats'. Отправляет администратору сводку метрик экспорта.
+
+    Args:
+        update (Update): Объект обновления, содержащий информацию о сообщении.
+        context (ContextTypes.DEFAULT_TYPE): Контекст, содержащий данные о текущем разговоре.
+
+    Returns:
+        None
+    """
+    if not is_admin(update.message.chat_id):
+        logger.warning(f"Unauthorized /stats attempt by user {update.message.chat_id}")
+        await update.message.reply_text('Команда доступна только администраторам.')
+        return
+    lines = [
+        f"Очередь: ожидает {export_queue.depth}, выполняется {export_queue.running}",
+        f"Кэш отчетов: {report_cache.stats()}",
+        f"Хранилище отчетов: {report_store.stats()}",
+        f"Попадания в заранее подготовленные отчеты: {warmup.hit_rates()}",
+        f"Задания всех процессов за час: {await asyncio.to_thread(state_store.job_stats, time.time() - 3600)}",
+        metrics.REGISTRY.summary() or "Метрик пока нет.",
+    ]
+    await update.message.reply_text("\n".join(lines))
 
 
 async def take_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
-    Логирует все сообщения, которые поступают от пользователя.
+    Логирует сообщения, которые поступают от пользователя (выборочно, см. LOG_MESSAGES_PER_SECOND).
 
     Args:
         update (Update): Объект обновления, содержащий информацию о сообщении.
@@ -219,43 +343,119 @@ async def take_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         None
     """
     user_message = update.message.text
-    logger.info(f"User {update.message.chat_id} sent message: {user_message}")
-
-
-app = ApplicationBuilder().token(os.getenv("TOKEN")).build()
-
-# Создаем ConversationHandler для команды export
-export_conversation_handler = ConversationHandler(
-    entry_points=[CommandHandler('export', export)],  # Точка входа для команды export
-    states={
-        ST_POINT: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_st_and_end_points)],  # Обработка диапазона
-    },
-    fallbacks=[CommandHandler('cancel', cancel)]  # Обработчик для отмены
-)
-
-# Добавляем ConversationHandler для команды export
-app.add_handler(export_conversation_handler)
-
-# Создаем ConversationHandler для логина
-login_conversation_handler = ConversationHandler(
-    entry_points=[CommandHandler('login', login)],  # Точка входа для команды login
-    states={
-        LOGIN: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_login)],  # Состояние для логина
-        PASSWORD: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_password)],  # Состояние для пароля
-    },
-    fallbacks=[CommandHandler('cancel', cancel)]  # Обработчик для отмены
-)
-
-# Добавляем ConversationHandler для логина
-app.add_handler(login_conversation_handler)
-
-scheduler = BackgroundScheduler()
-scheduler.add_job(scheduled_clear_tables, 'interval', minutes=60)
-scheduler.start()
-
-# Команды
-app.add_handler(CommandHandler("start", start))
-app.add_handler(MessageHandler(Text(), take_message))
-logger.info("Bot started...")
-
-app.run_polling()
+    message_logger.info(f"User {update.message.chat_id} sent message: {user_message}",
+                        extra={"chat_id": update.message.chat_id})
+
+
+async def post_init(application) -> None:
+    """Запускает воркеры очереди экспорта после инициализации приложения."""
+    await export_queue.start()
+
+
+async def post_shutdown(application) -> None:
+    """Останавливает воркеры очереди экспорта при завершении работы."""
+    await export_queue.stop()
+
+
+def health() -> dict:
+    """Дополнительные поля /healthz в режиме вебхука: состояние очереди экспорта."""
+    return {"export_queue": export_queue.depth, "export_running": export_queue.running}
+
+
+def build_application():
+    """
+    Создает приложение бота и регистрирует обработчики.
+
+    Returns:
+        Application: Настроенное приложение python-telegram-bot.
+    """
+    concurrency = int(os.getenv("UPDATE_CONCURRENCY", "8"))
+    builder = (
+        ApplicationBuilder()
+        .token(os.getenv("TOKEN"))
+        # Обновления разных чатов обрабатываются параллельно, одного чата — по очереди;
+        # каждому одновременно работающему обработчику нужно свое соединение с Bot API
+        .concurrent_updates(ChatOrderedUpdateProcessor(concurrency))
+        .connection_pool_size(concurrency)
+        # Сессии и состояния диалогов хранятся вне процесса и переживают перезапуск
+        .persistence(StatePersistence(state_store, update_interval=float(os.getenv("PERSISTENCE_INTERVAL", "60"))))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if os.getenv("TELEGRAM_API_URL"):
+        # Собственный сервер Bot API (или его заглушка в бенчмарке)
+        api_url = os.getenv("TELEGRAM_API_URL").rstrip("/")
+        builder = builder.base_url(f"{api_url}/bot").base_file_url(f"{api_url}/file/bot")
+    app = builder.build()
+
+    # Перед обработкой обновления состояния диалогов подтягиваются из хранилища: их мог изменить другой процесс
+    app.add_handler(TypeHandler(Update, refresh_conversations), group=-1)
+
+    # Создаем ConversationHandler для команды export
+    export_conversation_handler = SharedConversationHandler(
+        name="export",
+        persistent=True,
+        entry_points=[CommandHandler('export', export)],  # Точка входа для команды export
+        states={
+            ST_POINT: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_st_and_end_points)],  # Обработка диапазона
+        },
+        fallbacks=[CommandHandler('cancel', cancel)]  # Обработчик для отмены
+    )
+
+    # Добавляем ConversationHandler для команды export
+    app.add_handler(export_conversation_handler)
+
+    # Создаем ConversationHandler для логина
+    login_conversation_handler = SharedConversationHandler(
+        name="login",
+        persistent=True,
+        entry_points=[CommandHandler('login', login)],  # Точка входа для команды login
+        states={
+            LOGIN: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_login)],  # Состояние для логина
+            PASSWORD: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_password)],  # Состояние для пароля
+        },
+        fallbacks=[CommandHandler('cancel', cancel)]  # Обработчик для отмены
+    )
+
+    # Добавляем ConversationHandler для логина
+    app.add_handler(login_conversation_handler)
+
+    # Команды
+    app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("stats", stats))
+    app.add_handler(MessageHandler(Text(), take_message))
+
+    # После всех обработчиков изменения сразу сохраняются, чтобы их увидели другие процессы
+    app.add_handler(TypeHandler(Update, flush_persistence), group=100)
+    return app
+
+
+if __name__ == '__main__':
+    app = build_application()
+
+    try:
+        ensure_rollup_schema()
+    except Exception as e:
+        logger.error(f"Failed to create rollup tables, will retry on refresh: {e}")
+
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(scheduled_clear_tables, 'interval', minutes=60)
+    # Почасовой агрегат заказов обновляется инкрементально, сверка с orders — раз в час
+    scheduler.add_job(refresh_hourly_rollup, 'interval', minutes=int(os.getenv("ROLLUP_INTERVAL_MINUTES", "5")),
+                      max_instances=1, coalesce=True, next_run_time=datetime.now())
+    scheduler.add_job(scheduled_rollup_check, 'cron', minute=30)
+    # Отчеты за только что закрывшиеся диапазоны готовятся заранее, вскоре после начала часа
+    scheduler.add_job(warmup.warm_reports, 'cron', minute=int(os.getenv("WARMUP_MINUTE", "2")),
+                      max_instances=1, coalesce=True)
+    scheduler.start()
+
+    if os.getenv("METRICS_PORT"):
+        metrics.start_metrics_server(int(os.getenv("METRICS_PORT")), os.getenv("METRICS_HOST", "127.0.0.1"))
+        logger.info(f"Metrics endpoint started on port {os.getenv('METRICS_PORT')}")
+
+    if os.getenv("BOT_MODE", "polling") == "webhook":
+        logger.info("Bot started in webhook mode...")
+        webhook.run(app, health)
+    else:
+        logger.info("Bot started...")
+        app.run_polling()
@@ -1,84 +1,254 @@
-from datetime import datetime
-import psycopg2
-import pandas as pd
-from openpyxl import load_workbook
-from openpyxl.utils import get_column_letter
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time as day_time, timedelta
+from decimal import ROUND_HALF_UP, Decimal
+from src import metrics
+from src.db_pool import execute_prepared, get_pool
+from src.writers import CSV_COMPRESSION, open_output, write_rows
 
-def fetch_courier_data_to_excel(st_p, end_p, host, port, user, password, database, output_file):
 
-    today = datetime.now()
-    # Форматируем дату в нужный формат
-    formatted_date = today.strftime('%Y-%m-%d')
-    """
-    Подключается к базе данных, извлекает данные из таблицы courier и экспортирует их в файл Excel.
-
-    :param st_p: Начало периода.
-    :param end_p: Конец периода.
-    :param host: Хост базы данных.
-    :param port: Порт базы данных.
-    :param user: Имя пользователя для подключения.
-    :param password: Пароль для подключения.
-    :param database: Имя базы данных.
-    :param output_file: Путь для сохранения Excel-файла.
-    """
-    try:
-        # Подключение к базе данных
-        connection = psycopg2.connect(
-            host=host,
-            port=port,
-            user=user,
-            password=password,
-            database=database
-        )
-        print("Успешное подключение к базе данных.")
-
-        # SQL-запрос
-        query = (f"""SELECT
-                    couriers.courier_id AS ID,
-                    couriers.courier_name AS ФИО,
-                    COUNT(orders.order_id) AS КОЛИЧЕСТВО_ДОСТАВОК,
-                    SUM(orders.time_taken) AS ОБЩЕЕ_ВРЕМЯ_ОЖИДАНИЯ,
-                    ROUND(SUM(orders.time_taken)::numeric / NULLIF(COUNT(orders.order_id), 0), 2) AS СРЕДНЕЕ_ВРЕМЯ_ОЖИДАНИЯ
+# Количество доставок и суммарное время ожидания по курьерам за период [$1, $2).
+# Средние считаются уже после сложения частичных итогов по дням (см. merge_courier_totals)
+COURIER_TOTALS_SQL = """SELECT
+                    couriers.courier_id,
+                    couriers.courier_name,
+                    COUNT(orders.order_id),
+                    SUM(orders.time_taken)
                 FROM couriers
                 JOIN orders ON orders.courier_id = couriers.courier_id
-                WHERE orders.cur_time >= '{formatted_date} {st_p:02d}:00:00' AND orders.cur_time < '{formatted_date} {end_p:02d}:00:00'
-                GROUP BY couriers.courier_id, couriers.courier_name
-                ORDER BY СРЕДНЕЕ_ВРЕМЯ_ОЖИДАНИЯ DESC;""")
+                WHERE orders.cur_time >= $1 AND orders.cur_time < $2
+                GROUP BY couriers.courier_id, couriers.courier_name"""
+
+# Те же итоги по почасовому агрегату (см. src.rollup) плюс "хвост" заказов начиная с его водяного знака
+# (начала первого часа, которого еще нет в агрегате).
+# Границы периода должны быть выровнены по часу
+ROLLUP_TOTALS_SQL = """WITH bounds AS (
+                    SELECT $1::timestamp AS st, $2::timestamp AS en
+                ),
+                wm AS (
+                    SELECT COALESCE(
+                        (SELECT last_cur_time FROM rollup_watermark WHERE name = 'courier_hourly'),
+                        '-infinity'::timestamp) AS t
+                ),
+                parts AS (
+                    SELECT r.courier_id, r.orders_count AS cnt, r.time_taken_sum AS total
+                    FROM courier_hourly_rollup r, bounds
+                    WHERE r.day BETWEEN bounds.st::date AND bounds.en::date
+                      AND r.day + make_interval(hours => r.hour) >= bounds.st
+                      AND r.day + make_interval(hours => r.hour) < bounds.en
+                    UNION ALL
+                    SELECT orders.courier_id, COUNT(orders.order_id), SUM(orders.time_taken)::numeric
+                    FROM orders, wm, bounds
+                    WHERE orders.cur_time >= wm.t AND orders.cur_time >= bounds.st AND orders.cur_time < bounds.en
+                    GROUP BY orders.courier_id
+                )
+                SELECT couriers.courier_id, couriers.courier_name, SUM(parts.cnt), SUM(parts.total)
+                FROM couriers
+                JOIN parts ON parts.courier_id = couriers.courier_id
+                GROUP BY couriers.courier_id, couriers.courier_name"""
+
+# Заголовки и ширины колонок отчета по курьерам
+COURIER_REPORT_COLUMNS = ["id", "ФИО", "КОЛИЧЕСТВО_ДОСТАВОК", "ОБЩЕЕ_ВРЕМЯ_ОЖИДАНИЯ", "СРЕДНЕЕ_ВРЕМЯ_ОЖИДАНИЯ"]
+COURIER_REPORT_WIDTHS = [5, 20, 10, 10, 10]
+
+# Водяной знак периода: меняется при появлении или изменении заказов в периоде
+ORDERS_WATERMARK_SQL = """SELECT MAX(cur_time), COUNT(*)
+                FROM orders
+                WHERE cur_time >= $1 AND cur_time < $2"""
+
+# Верхняя граница числа строк отчета по курьерам (для автоматического выбора формата)
+COURIERS_COUNT_SQL = "SELECT COUNT(*) FROM couriers"
+
+# Колонки выгрузки отдельных заказов
+ORDERS_DETAIL_COLUMNS = ["order_id", "courier_id", "courier_name", "cur_time", "time_taken"]
+
+# Сколько строк за раз забирается с сервера при выгрузке заказов в xlsx и parquet
+ORDERS_DETAIL_ITERSIZE = 10000
+
+# Выгрузка отдельных заказов за период; параметры подставляются через mogrify
+ORDERS_DETAIL_SQL = """SELECT
+                    orders.order_id,
+                    orders.courier_id,
+                    couriers.courier_name,
+                    orders.cur_time,
+                    orders.time_taken
+                FROM orders
+                LEFT JOIN couriers ON couriers.courier_id = orders.courier_id
+                WHERE orders.cur_time >= %s AND orders.cur_time < %s"""
+
+
+def fetch_orders_watermark(period_start, period_end):
+    """
+    Возвращает водяной знак заказов за период: (max(cur_time), количество заказов).
+
+    :param period_start: Начало периода (datetime).
+    :param period_end: Конец периода (datetime, не включительно).
+    """
+    with get_pool().connection() as connection:
+        with connection.cursor() as cursor:
+            execute_prepared(cursor, "orders_watermark", ORDERS_WATERMARK_SQL, (period_start, period_end))
+            return tuple(cursor.fetchone())
+
+
+def fetch_couriers_count():
+    """Возвращает число курьеров — верхнюю границу числа строк отчета по курьерам."""
+    with get_pool().connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(COURIERS_COUNT_SQL)
+            return cursor.fetchone()[0]
+
+
+def split_by_day(period_start, period_end):
+    """
+    Делит период [period_start, period_end) на части, не пересекающие границу суток.
+
+    :return: Список пар (начало, конец) в хронологическом порядке.
+    """
+    chunks = []
+    chunk_start = period_start
+    while chunk_start < period_end:
+        next_day = datetime.combine(chunk_start.date() + timedelta(days=1), day_time())
+        chunk_end = min(next_day, period_end)
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end
+    return chunks
+
+
+def fetch_courier_totals(period_start, period_end):
+    """
+    Возвращает частичные итоги по курьерам за период: [(courier_id, courier_name, количество, сумма)].
 
-    # Используем pandas.read_sql_query с pgdb
-        cursor = connection.cursor()
-        cursor.execute(query)
+    По умолчанию итоги считаются по почасовому агрегату (REPORT_SOURCE=rollup),
+    REPORT_SOURCE=raw — по таблице orders.
+    """
+    with get_pool().connection() as connection:
+        with connection.cursor() as cursor:
+            with metrics.timer("export_query_seconds", "Время выполнения запроса отчета за часть периода"):
+                if os.getenv("REPORT_SOURCE", "rollup") == "rollup":
+                    execute_prepared(cursor, "courier_totals_rollup", ROLLUP_TOTALS_SQL, (period_start, period_end))
+                else:
+                    execute_prepared(cursor, "courier_totals", COURIER_TOTALS_SQL, (period_start, period_end))
+            with metrics.timer("export_fetch_seconds", "Время выборки строк отчета из базы"):
+                return cursor.fetchall()
 
-        # Извлекаем данные и преобразуем в DataFrame
-        columns = [desc[0] for desc in cursor.description]
-        data = cursor.fetchall()
-        df = pd.DataFrame(data, columns=columns)
 
-        # Сохранение в Excel
-        df.to_excel(output_file, index=False)
-        print(f"Данные успешно экспортированы в файл {output_file}.")
+def merge_courier_totals(partials):
+    """
+    Складывает частичные итоги по курьерам и считает точные средние.
 
-        # Открываем файл для редактирования
-        wb = load_workbook(output_file)
-        ws = wb.active
+    Среднее время ожидания равно сумме времени, деленной на сумму количеств по всем частям,
+    с округлением до двух знаков, как в ROUND(..., 2) PostgreSQL. Строки отсортированы по
+    среднему по убыванию; курьеры без времени ожидания идут первыми, как NULL при ORDER BY DESC.
 
-        # Устанавливаем ширину определенных колонок (например, 1 и 3)
-        columns_to_adjust = [1, 2, 3, 4, 5]  # Измените на нужные вам номера столбцов
-        new_widths = [5, 20, 10, 10, 10]  # Новые ширины для указанных столбцов
+    :param partials: Итерируемый набор списков строк fetch_courier_totals.
+    :return: Строки отчета (id, ФИО, количество, сумма, среднее).
+    """
+    totals = {}
+    for rows in partials:
+        for courier_id, courier_name, count, total in rows:
+            entry = totals.setdefault(courier_id, [courier_name, 0, None])
+            entry[1] += count
+            if total is not None:
+                entry[2] = (entry[2] or 0) + total
 
-        for col, width in zip(columns_to_adjust, new_widths):
-            column_letter = get_column_letter(col)
-            ws.column_dimensions[column_letter].width = width  # Устанавливаем ширину в 20
+    report = []
+    for courier_id, (courier_name, count, total) in totals.items():
+        average = None
+        if total is not None and count:
+            average = (Decimal(total) / count).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+        report.append((courier_id, courier_name, count, total, average))
+    report.sort(key=lambda row: (row[4] is None, row[4] or 0), reverse=True)
+    return report
+
+
+def fetch_courier_data_to_excel(period_start, period_end, output_file, fmt="xlsx"):
+    """
+    Извлекает данные о курьерах из базы данных и экспортирует их в файл Excel
+    (или другого формата, см. writers.OUTPUT_FORMATS) за один проход.
 
-        # Сохраняем изменения
-        wb.save(output_file)
-        print(f"Данные успешно экспортированы в файл {output_file}.")
+    Период делится на сутки (split_by_day); итоги за каждые сутки запрашиваются параллельно,
+    каждый на своем соединении из общего пула (число потоков — EXPORT_FANOUT_WORKERS),
+    а затем складываются в точные средние по курьерам (merge_courier_totals).
+
+    :param period_start: Начало периода (datetime).
+    :param period_end: Конец периода (datetime, не включительно).
+    :param output_file: Путь для сохранения файла.
+    :param fmt: Формат файла.
+    """
+    try:
+        chunks = split_by_day(period_start, period_end)
+        workers = min(len(chunks), int(os.getenv("EXPORT_FANOUT_WORKERS", "4")))
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="export-day") as executor:
+                partials = list(executor.map(lambda chunk: fetch_courier_totals(*chunk), chunks))
+        else:
+            partials = [fetch_courier_totals(*chunk) for chunk in chunks]
+        rows = merge_courier_totals(partials)
+
+        # Выборка уже учтена по частям периода в fetch_courier_totals
+        started = time.perf_counter()
+        count = write_rows(fmt, output_file, COURIER_REPORT_COLUMNS, rows, COURIER_REPORT_WIDTHS)
+        _observe_write(time.perf_counter() - started, count, fmt)
+        print(f"Данные успешно экспортированы в файл {output_file} ({count} строк).")
 
     except Exception as e:
         print(f"Ошибка: {e}")
+        raise
+
 
-    finally:
-        # Закрытие подключения
-        if 'connection' in locals() and connection:
-            connection.close()
-            print("Подключение к базе данных закрыто.")
+def fetch_orders_to_csv(period_start, period_end, output_file, fmt="csv"):
+    """
+    Выгружает отдельные заказы за период в CSV-файл (или другого формата, см. writers.OUTPUT_FORMATS).
+
+    Для CSV (в том числе сжатого) данные передаются сервером через COPY ... TO STDOUT
+    и пишутся в файл по мере поступления, поэтому расход памяти не зависит от числа заказов,
+    а первые байты появляются в файле сразу после начала выполнения запроса.
+    Для xlsx и parquet строки читаются серверным курсором порциями по ORDERS_DETAIL_ITERSIZE.
+
+    :param period_start: Начало периода (datetime).
+    :param period_end: Конец периода (datetime, не включительно).
+    :param output_file: Путь для сохранения файла.
+    :param fmt: Формат файла.
+    """
+    try:
+        with get_pool().connection() as connection:
+            if fmt in CSV_COMPRESSION:
+                with connection.cursor() as cursor:
+                    query = cursor.mogrify(ORDERS_DETAIL_SQL, (period_start, period_end)).decode()
+                    started = time.perf_counter()
+                    with open_output(output_file, CSV_COMPRESSION[fmt]) as file:
+                        # BOM нужен, чтобы Excel правильно распознал кириллицу в UTF-8
+                        file.write("\ufeff".encode("utf-8"))
+                        cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER, ENCODING 'UTF8')",
+                                           file)
+                    count = max(cursor.rowcount, 0)
+            else:
+                # Серверный курсор: строки приходят порциями, а не все сразу
+                with connection.cursor(name="orders_detail") as cursor:
+                    cursor.itersize = ORDERS_DETAIL_ITERSIZE
+                    started = time.perf_counter()
+                    cursor.execute(ORDERS_DETAIL_SQL, (period_start, period_end))
+                    count = write_rows(fmt, output_file, ORDERS_DETAIL_COLUMNS, cursor)
+            # Запрос, выборка и запись идут одним потоком и не разделяются по времени
+            _observe_write(time.perf_counter() - started, count, fmt, streamed=True)
+        print(f"Заказы успешно экспортированы в файл {output_file}.")
+
+    except Exception as e:
+        print(f"Ошибка: {e}")
+        raise
+
+
+def _observe_write(seconds, rows, fmt, streamed=False):
+    """
+    Записывает в метрики время записи файла по формату и число строк отчета.
+
+    :param streamed: Выборка и запись шли одновременно (потоковая выгрузка заказов): время
+                     пишется в export_stream_seconds, а не в export_write_seconds.
+    """
+    if streamed:
+        metrics.observe("export_stream_seconds", seconds, "Время потоковой выгрузки: выборка и запись файла вместе",
+                        labels={"format": fmt})
+    else:
+        metrics.observe("export_write_seconds", seconds, "Время записи файла отчета", labels={"format": fmt})
+    metrics.observe("export_rows", rows, "Число строк в отчете", buckets=metrics.ROWS_BUCKETS)
@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2.extensions import connection as pg_connection
+from dotenv import load_dotenv
+from src import metrics
+
+load_dotenv()
+
+
+class PooledConnection(pg_connection):
+    """
+    Соединение из пула, помнящее, какие подготовленные запросы уже созданы в его сессии.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+class ConnectionPool:
+    """
+    Пул соединений с PostgreSQL, общий для всего процесса.
+
+    При выдаче соединение проверяется запросом SELECT 1; закрытые и "мертвые"
+    соединения (например, после перезапуска сервера) выбрасываются и заменяются новыми.
+    Если все соединения заняты, вызывающий поток ждет, а не получает ошибку.
+
+    :param minconn: Минимальное число открытых соединений.
+    :param maxconn: Максимальное число открытых соединений.
+    :param db_config: Параметры подключения для psycopg2.connect.
+    """
+
+    def __init__(self, minconn, maxconn, **db_config):
+        self.maxconn = maxconn
+        self._pool = pg_pool.ThreadedConnectionPool(minconn, maxconn, connection_factory=PooledConnection, **db_config)
+        self._slots = threading.BoundedSemaphore(maxconn)
+
+    @contextmanager
+    def connection(self):
+        """
+        Выдает проверенное соединение и возвращает его в пул после использования.
+
+        Открытая транзакция откатывается при возврате. Если во время работы соединение
+        оборвалось, оно закрывается и не возвращается в пул.
+        """
+        started = time.perf_counter()
+        self._slots.acquire()
+        try:
+            conn = self._checkout()
+            metrics.observe("db_connect_seconds", time.perf_counter() - started,
+                            "Время получения проверенного соединения из пула")
+            broken = False
+            try:
+                yield conn
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                broken = True
+                raise
+            finally:
+                if not broken and not conn.closed:
+                    try:
+                        conn.rollback()
+                    except psycopg2.Error:
+                        broken = True
+                self._pool.putconn(conn, close=broken or bool(conn.closed))
+        finally:
+            self._slots.release()
+
+    def _checkout(self):
+        # Пробуем столько раз, сколько соединений может быть в пуле, плюс одно новое
+        for _ in range(self.maxconn + 1):
+            conn = self._pool.getconn()
+            if not conn.closed and self._is_alive(conn):
+                return conn
+            self._pool.putconn(conn, close=True)
+        raise psycopg2.OperationalError("Не удалось получить рабочее соединение с базой данных.")
+
+    @staticmethod
+    def _is_alive(conn):
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    def close(self):
+        """Закрывает все соединения пула."""
+        self._pool.closeall()
+
+
+def execute_prepared(cursor, name, sql, params):
+    """
+    Выполняет запрос как подготовленный: PREPARE делается один раз на соединение,
+    далее используется только EXECUTE, и план запроса не строится заново.
+
+    :param cursor: Курсор соединения из пула.
+    :param name: Имя подготовленного запроса.
+    :param sql: Текст запроса с параметрами вида $1, $2, ...
+    :param params: Значения параметров.
+    """
+    conn = cursor.connection
+    if name not in conn.prepared:
+        cursor.execute(f"PREPARE {name} AS {sql}")
+        conn.prepared.add(name)
+    placeholders = ", ".join(["%s"] * len(params))
+    cursor.execute(f"EXECUTE {name} ({placeholders})", params)
+
+
+def db_config_from_env():
+    """Собирает параметры подключения к базе данных из переменных окружения."""
+    return {
+        "host": os.getenv("HOST"),
+        "port": os.getenv("PORT"),
+        "user": os.getenv("USER_NAME"),
+        "password": os.getenv("PASSWORD"),
+        "database": os.getenv("DBNAME"),
+    }
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Возвращает пул соединений процесса, создавая его при первом обращении.
+
+    Размеры пула задаются переменными окружения DB_POOL_MIN и DB_POOL_MAX.
+    В дочернем процессе (EXPORT_EXECUTOR=process) создается свой пул: соединения
+    родителя в нем не используются.
+    """
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                # Унаследованный пул не закрываем: закрытие завершило бы сессии родительского процесса
+                _pool = ConnectionPool(
+                    int(os.getenv("DB_POOL_MIN", "1")),
+                    int(os.getenv("DB_POOL_MAX", "5")),
+                    **db_config_from_env(),
+                )
+                _pool_pid = os.getpid()
+    return _pool
@@ -1,52 +1,247 @@
 import os
-from src.bot_db import fetch_courier_data_to_excel
+import re
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta
+from src.bot_db import fetch_courier_data_to_excel, fetch_couriers_count, fetch_orders_to_csv, fetch_orders_watermark
+from src.report_cache import ReportCache, report_file_name, report_key
+from src.report_store import ReportStore
+from src.state_store import get_state_store
+from src.writers import XLSX_MAX_ROWS, atomic_output, available_formats
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Путь к папке data в корне
+DATA_DIR = os.path.join(os.getcwd(), "data")
 
-def export2xlsx(file, st_point, end_point):
+# Максимальная длина периода отчета в днях
+MAX_PERIOD_DAYS = int(os.getenv("EXPORT_MAX_DAYS", "92"))
+
+# В режиме "auto" отчет больше этого числа строк пишется не в xlsx, а в EXPORT_AUTO_FORMAT
+AUTO_XLSX_MAX_ROWS = int(os.getenv("EXPORT_AUTO_XLSX_MAX_ROWS", "50000"))
+AUTO_FORMAT = os.getenv("EXPORT_AUTO_FORMAT", "csv.gz")
+
+# Срок аренды на формирование отчета: пока она не истекла, другие процессы бота ждут, а не собирают тот же отчет
+REPORT_LEASE_SECONDS = int(os.getenv("REPORT_LEASE_SECONDS", "600"))
+
+# "14-17" или "2024-10-01 14-17"
+_HOURS_RE = re.compile(r"(?:(?P<day>\d{4}-\d{2}-\d{2})\s+)?(?P<st>\d{1,2})-(?P<end>\d{1,2})")
+# "2024-10-01..2024-10-07" или "2024-10-01 08..2024-10-07 20"
+_RANGE_RE = re.compile(r"(?P<st_day>\d{4}-\d{2}-\d{2})(?:\s+(?P<st_hour>\d{1,2}))?\s*\.\.\s*"
+                       r"(?P<end_day>\d{4}-\d{2}-\d{2})(?:\s+(?P<end_hour>\d{1,2}))?")
+
+# Хранилище файлов отчетов с бюджетом по объему и возрасту; при REPORT_STORE_SHARED=1 закрепления файлов
+# общие для процессов бота
+report_store = ReportStore.from_env(DATA_DIR, state_store=get_state_store)
+
+# Кэш готовых отчетов процесса
+report_cache = ReportCache(report_store)
+
+# Блокировки по ключу отчета: один и тот же отчет в процессе формирует только один поток.
+# Ключ -> [блокировка, число потоков, которые ее держат или ждут]; запись удаляется вместе с последним потоком
+_build_locks = {}
+_build_locks_guard = threading.Lock()
+
+
+def parse_period(text, today=None):
+    """
+    Разбирает период отчета из текста пользователя.
+
+    Поддерживаемые форматы:
+    "14-17"                          — часы 14-17 сегодняшнего дня;
+    "2024-10-01 14-17"               — часы 14-17 указанного дня;
+    "2024-10-01..2024-10-07"         — дни с 1 по 7 октября включительно;
+    "2024-10-01 08..2024-10-07 20"   — с 08:00 1 октября до 20:00 7 октября.
+
+    Параметры:
+    text (str): Текст периода.
+    today (date): Текущая дата, по умолчанию date.today().
+
+    Возвращает:
+    tuple: Границы периода (начало, конец) как datetime, конец не включительно.
+
+    Исключения:
+    ValueError: Если текст не соответствует ни одному формату или период пустой/слишком длинный.
+    """
+    text = text.strip()
+    match = _HOURS_RE.fullmatch(text)
+    if match:
+        day = date.fromisoformat(match["day"]) if match["day"] else (today or date.today())
+        period_start = _at_hour(day, int(match["st"]))
+        period_end = _at_hour(day, int(match["end"]))
+    else:
+        match = _RANGE_RE.fullmatch(text)
+        if not match:
+            raise ValueError("Диапазон должен быть в формате 'st_p-end_p', 'YYYY-MM-DD st_p-end_p' "
+                             "или 'YYYY-MM-DD[ HH]..YYYY-MM-DD[ HH]'.")
+        period_start = _at_hour(date.fromisoformat(match["st_day"]), int(match["st_hour"] or 0))
+        end_day = date.fromisoformat(match["end_day"])
+        # Без часа конечный день включается в период целиком
+        period_end = _at_hour(end_day, int(match["end_hour"]) if match["end_hour"] else 24)
+
+    if period_start >= period_end:
+        raise ValueError("Начало периода должно быть меньше конца периода.")
+    if period_end - period_start > timedelta(days=MAX_PERIOD_DAYS):
+        raise ValueError(f"Период не может быть длиннее {MAX_PERIOD_DAYS} дней.")
+    return period_start, period_end
+
+
+def check_format(fmt):
+    """
+    Проверяет, что формат файла известен и доступен с установленными зависимостями.
+
+    Исключения:
+    ValueError: Если формат недоступен.
+    """
+    formats = available_formats()
+    if fmt != "auto" and fmt not in formats:
+        raise ValueError(f"Формат {fmt} недоступен, доступны: {', '.join(formats + ['auto'])}.")
+
+
+def prebuilt_report(period_start, period_end, kind="couriers", fmt=None):
+    """
+    Возвращает имя готового окончательного файла отчета за закрытый период или None.
+
+    Не обращается к базе, поэтому подходит для проверки прямо в обработчике бота.
+    Для формата "auto" подходит файл любого из двух форматов, между которыми он выбирает.
+    """
+    for candidate in _format_candidates(fmt):
+        file = report_file_name(report_key(period_start, period_end, kind, candidate))
+        if report_cache.lookup_final(file, period_end):
+            return file
+    return None
+
+
+def _at_hour(day, hour):
+    if not 0 <= hour <= 24:
+        raise ValueError("Час должен быть от 0 до 24.")
+    return datetime.combine(day, time()) + timedelta(hours=hour)
+
+
+def export2xlsx(period_start, period_end, fmt="xlsx"):
     """
     Экспортирует данные о курьерах в формат Excel.
 
-    Функция подключается к базе данных с использованием параметров из окружения,
-    извлекает данные о курьерах в заданном диапазоне времени (start_point, end_point),
-    и сохраняет их в файл Excel в папку "data" в корневом каталоге проекта.
+    Функция берет соединения из общего пула (параметры подключения читаются из окружения один раз),
+    извлекает данные о курьерах за период [period_start, period_end), который может охватывать
+    несколько дней, и сохраняет их в файл Excel в папку "data" в корневом каталоге проекта.
+    Если актуальный файл за этот период уже есть (см. ReportCache), запрос к базе не выполняется.
 
     Параметры:
-    file (str): Имя выходного Excel файла (например, "couriers_data.xlsx").
-    st_point (datetime): Начальная точка временного диапазона для выборки данных.
-    end_point (datetime): Конечная точка временного диапазона для выборки данных.
+    period_start (datetime): Начало периода, выровненное по часу.
+    period_end (datetime): Конец периода (не включительно), выровненный по часу.
+    fmt (str): Формат файла (см. writers.OUTPUT_FORMATS) или "auto" — xlsx, если строк
+               не больше EXPORT_AUTO_XLSX_MAX_ROWS, иначе EXPORT_AUTO_FORMAT.
 
     Возвращает:
-    None: Функция сохраняет данные в указанный файл, не возвращая значения.
+    str: Имя файла отчета в папке "data".
 
     Пример использования:
-    export2xlsx("couriers_data.xlsx", "2024-01-01 00:00:00", "2024-01-31 23:59:59")
-    """
-    # Конфигурация базы данных
-    DB_CONFIG = {
-        "host": os.getenv("HOST"),  # Укажите хост
-        "port": os.getenv("PORT"),  # Укажите порт
-        "user": os.getenv("USER_NAME"),  # Укажите пользователя
-        "password": os.getenv("PASSWORD"),  # Укажите пароль
-        "database": os.getenv("DBNAME"),  # Укажите базу данных
-    }
-
-    # Путь к выходному файлу
-    DATA_DIR = os.path.join(os.getcwd(), "data")  # Путь к папке data в корне
-    os.makedirs(DATA_DIR, exist_ok=True)  # Создать папку, если она не существует
-
-    OUTPUT_FILE = os.path.join(DATA_DIR, file)  # Путь к файлу
-
-    # Вызов функции экспорта
-    fetch_courier_data_to_excel(st_point, end_point,
-                                host=DB_CONFIG["host"],
-                                port=DB_CONFIG["port"],
-                                user=DB_CONFIG["user"],
-                                password=DB_CONFIG["password"],
-                                database=DB_CONFIG["database"],
-                                output_file=OUTPUT_FILE,
-                                )
+    export2xlsx(*parse_period("2024-10-01..2024-10-31"))
+    """
+    fmt = _resolve_format("couriers", period_start, period_end, fmt)
+    key = report_key(period_start, period_end, fmt=fmt)
+    return _export_cached(key, (period_start, period_end), fetch_courier_data_to_excel)
+
+
+def export_orders(period_start, period_end, fmt="csv"):
+    """
+    Экспортирует отдельные заказы за период в CSV-файл.
+
+    В отличие от export2xlsx, выгружает не агрегат по курьерам, а все строки orders
+    (order_id, курьер, cur_time, time_taken), потоково, без загрузки в память.
+    Кэширование работает так же, как для отчета по курьерам.
+
+    Параметры:
+    period_start (datetime): Начало периода.
+    period_end (datetime): Конец периода (не включительно).
+    fmt (str): Формат файла, как у export2xlsx. Выгрузка, не помещающаяся на лист Excel
+               (XLSX_MAX_ROWS строк с заголовком), вместо xlsx пишется в EXPORT_AUTO_FORMAT.
+
+    Возвращает:
+    str: Имя файла в папке "data".
+    """
+    fmt = _resolve_format("detail", period_start, period_end, fmt)
+    key = report_key(period_start, period_end, kind="detail", fmt=fmt)
+    return _export_cached(key, (period_start, period_end), fetch_orders_to_csv)
+
+
+def _export_cached(key, period, build):
+    """
+    Отдает файл отчета из кэша или формирует его функцией build(period_start, period_end, output_file, fmt).
+    """
+    period_start, period_end = period
+    fmt = key[1]
+    file = report_file_name(key)
+
+    with _build_lock(key):
+        # Поток, ждавший блокировку, найдет в кэше файл, только что собранный другим потоком
+        if report_cache.lookup(key, file, period_end, lambda: fetch_orders_watermark(period_start, period_end)):
+            print(f"Отчет взят из кэша: {file}")
+            return file
+
+        # Между процессами бота отчет формирует только владелец аренды
+        with get_state_store().lease(f"report:{file}", ttl=REPORT_LEASE_SECONDS):
+            # Другой процесс мог собрать отчет, пока мы ждали аренду
+            if report_cache.is_final(file, period_end):
+                print(f"Отчет собран другим процессом: {file}")
+                return file
+
+            # Водяной знак снимается до выборки: изменения во время экспорта приведут к пересборке в следующий раз
+            read_started = datetime.now().timestamp()
+            watermark = fetch_orders_watermark(period_start, period_end)
+
+            # Вызов функции экспорта; файл пишется во временный и подменяется атомарно,
+            # а хранилище не удалит его, пока запись не закончена и файл не добавлен в индекс
+            with report_store.in_use(file) as OUTPUT_FILE:
+                with atomic_output(OUTPUT_FILE) as tmp_file:
+                    build(period_start, period_end, output_file=tmp_file, fmt=fmt)
+                    # Время изменения файла — начало чтения данных, а не конец записи: по нему
+                    # кэш решает, окончательный ли отчет (см. ReportCache._is_final)
+                    os.utime(tmp_file, (read_started, read_started))
+                # add приводит хранилище к бюджету; только что собранный файл при этом закреплен
+                report_store.add(file)
+            report_cache.remember(key, watermark)
 
     print(f"Данные успешно сохранены в файле: {OUTPUT_FILE}")
+    return file
+
+
+def _resolve_format(kind, period_start, period_end, fmt):
+    """
+    Заменяет "auto" на конкретный формат по ожидаемому числу строк отчета, а xlsx для выгрузки
+    заказов — на AUTO_FORMAT, если заказы не поместятся на лист Excel.
+    """
+    # Отчет по курьерам всегда помещается на лист, лишние запросы к базе для него не нужны
+    if fmt != "auto" and (fmt, kind) != ("xlsx", "detail"):
+        return fmt
+    # Уже собранный окончательный файл отдается в том формате, в котором он есть
+    for candidate in _format_candidates(fmt):
+        if report_cache.is_final(report_file_name(report_key(period_start, period_end, kind, candidate)), period_end):
+            return candidate
+    # Число заказов за период — точное число строк выгрузки заказов и верхняя граница для отчета по курьерам
+    rows = fetch_orders_watermark(period_start, period_end)[1]
+    if kind == "couriers":
+        rows = min(rows, fetch_couriers_count())
+    limit = XLSX_MAX_ROWS - 1 if fmt == "xlsx" else min(AUTO_XLSX_MAX_ROWS, XLSX_MAX_ROWS - 1)
+    return "xlsx" if rows <= limit else AUTO_FORMAT
+
+
+def _format_candidates(fmt):
+    return ("xlsx", AUTO_FORMAT) if fmt == "auto" else (fmt,)
+
+
+@contextmanager
+def _build_lock(key):
+    with _build_locks_guard:
+        entry = _build_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _build_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _build_locks[key]
@@ -0,0 +1,74 @@
+import hashlib
+import os
+
+# Вид записей индекса в общем хранилище состояния
+FILE_ID_KIND = "file_id"
+
+
+class FileIdIndex:
+    """
+    Постоянный индекс file_id, которые Telegram вернул при отправке отчетов.
+
+    Для каждого имени отчета хранится хэш содержимого отправленного файла и его file_id.
+    Пока содержимое файла не изменилось, отчет можно отправить по file_id без повторной
+    загрузки. Хэш пересчитывается, только если у файла изменились размер или время изменения.
+    Записи хранятся в общем хранилище состояния по одной на отчет, поэтому переживают перезапуск
+    и общие для всех процессов бота: процессы не перезаписывают записи друг друга.
+
+    :param state_store: Хранилище состояния (src.state_store.StateStore).
+    """
+
+    def __init__(self, state_store):
+        self.state_store = state_store
+
+    def lookup(self, name, file_path):
+        """
+        Возвращает file_id для отчета name, если содержимое file_path не изменилось с момента отправки.
+        Если файла нет (например, его удалило хранилище другого процесса), возвращает None.
+        """
+        entry = self.state_store.load(FILE_ID_KIND, name)
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(file_path)
+            if stat.st_size == entry["size"] and stat.st_mtime_ns == entry["mtime_ns"]:
+                return entry["file_id"]
+            changed = _sha256(file_path) != entry["hash"]
+        except FileNotFoundError:
+            return None
+        if changed:
+            self.invalidate(name)
+            return None
+        # Файл пересобран с тем же содержимым: запоминаем новые размер и время, чтобы не хэшировать снова
+        entry.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+        self.state_store.save(FILE_ID_KIND, name, entry)
+        return entry["file_id"]
+
+    def store(self, name, file_path, file_id):
+        """
+        Запоминает file_id, полученный при отправке file_path.
+        Если файла уже нет, ничего не делает.
+        """
+        try:
+            stat = os.stat(file_path)
+            entry = {
+                "hash": _sha256(file_path),
+                "file_id": file_id,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+            }
+        except FileNotFoundError:
+            return
+        self.state_store.save(FILE_ID_KIND, name, entry)
+
+    def invalidate(self, name):
+        """Удаляет запись об отчете name."""
+        self.state_store.drop(FILE_ID_KIND, name)
+
+
+def _sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,224 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from logging.handlers import QueueListener
+from dotenv import load_dotenv
+from src import metrics
+from src.logs import init_worker_logging
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class ExportQueueFull(Exception):
+    """Очередь экспорта заполнена, новое задание не может быть принято."""
+
+
+class UserLimitExceeded(Exception):
+    """У пользователя уже выполняется максимально допустимое число заданий."""
+
+
+class ExportJob:
+    """
+    Задание на формирование отчета.
+
+    :param user_id: Идентификатор пользователя (чата), поставившего задание.
+    :param func: Синхронная функция, выполняемая в пуле воркеров.
+    :param args: Позиционные аргументы для func.
+    :param on_done: Корутина-обработчик, вызываемая как on_done(result, error) после завершения.
+                    Для присоединенных запросов обработчики хранятся в ExportQueue.
+    """
+
+    def __init__(self, user_id, func, args, on_done):
+        self.job_id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.func = func
+        self.args = args
+        self.on_done = on_done
+        self.submitted_at = time.perf_counter()
+        # Задача записи задания в хранилище; следующие записи о задании ждут ее завершения
+        self.recorded = None
+
+
+class ExportQueue:
+    """
+    Ограниченная очередь заданий экспорта с пулом воркеров.
+
+    Обработчики бота кладут задания в очередь и сразу возвращают управление,
+    а тяжелая работа (запрос к БД и запись файла) выполняется в пуле потоков
+    или процессов, не блокируя цикл событий asyncio.
+
+    :param workers: Число одновременно выполняемых заданий (глобальный лимит).
+    :param max_size: Максимальная глубина очереди ожидающих заданий.
+    :param per_user_limit: Максимальное число заданий одного пользователя (в очереди и в работе).
+    :param executor_kind: Тип пула: "thread" или "process".
+    :param job_store: Хранилище записей о заданиях (src.state_store.StateStore) или None.
+    """
+
+    def __init__(self, workers=2, max_size=20, per_user_limit=1, executor_kind="thread", job_store=None):
+        self.workers = workers
+        self.max_size = max_size
+        self.per_user_limit = per_user_limit
+        self.executor_kind = executor_kind
+        self.job_store = job_store
+        self._queue = None
+        self._executor = None
+        self._log_listener = None
+        self._tasks = []
+        self._per_user = {}
+        self._running = 0
+        self._inflight = {}
+        # Выполняющиеся обработчики завершения; ссылки не дают сборщику мусора удалить задачи
+        self._callbacks = set()
+
+    @classmethod
+    def from_env(cls, job_store=None):
+        """
+        Создает очередь с параметрами из переменных окружения
+        EXPORT_WORKERS, EXPORT_QUEUE_SIZE, EXPORT_PER_USER_LIMIT и EXPORT_EXECUTOR.
+        """
+        return cls(
+            workers=int(os.getenv("EXPORT_WORKERS", "2")),
+            max_size=int(os.getenv("EXPORT_QUEUE_SIZE", "20")),
+            per_user_limit=int(os.getenv("EXPORT_PER_USER_LIMIT", "1")),
+            executor_kind=os.getenv("EXPORT_EXECUTOR", "thread"),
+            job_store=job_store,
+        )
+
+    @property
+    def depth(self):
+        """Количество заданий, ожидающих выполнения."""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    @property
+    def running(self):
+        """Количество заданий, выполняющихся в данный момент."""
+        return self._running
+
+    async def start(self):
+        """Создает пул и запускает воркеры. Должна вызываться внутри работающего цикла событий."""
+        if self.executor_kind == "process":
+            # Записи лога из процессов-воркеров передаются обработчикам этого процесса
+            log_queue = multiprocessing.Queue(int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+            self._log_listener = QueueListener(log_queue, *logging.getLogger().handlers)
+            self._log_listener.start()
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker_logging,
+                                                 initargs=(log_queue,))
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="export")
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Останавливает воркеры, обработчики завершения и пул."""
+        tasks = self._tasks + list(self._callbacks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._log_listener is not None:
+            self._log_listener.stop()
+            self._log_listener = None
+
+    def submit(self, user_id, func, args, on_done):
+        """
+        Ставит задание в очередь без ожидания.
+
+        Если задание с той же функцией и аргументами уже ждет в очереди или выполняется,
+        новое не создается: on_done будет вызван с результатом уже идущего задания.
+
+        :return: Позиция задания в очереди (1 — следующее к выполнению) или 0,
+                 если запрос присоединен к уже идущему заданию.
+        :raises UserLimitExceeded: Если у пользователя слишком много активных заданий.
+        :raises ExportQueueFull: Если очередь заполнена.
+        """
+        key = (func, tuple(args))
+        if key in self._inflight:
+            self._inflight[key].append(on_done)
+            metrics.inc("export_jobs_coalesced_total", help_text="Число запросов, присоединенных к идущему заданию")
+            return 0
+        if self._per_user.get(user_id, 0) >= self.per_user_limit:
+            raise UserLimitExceeded(f"У пользователя {user_id} уже {self.per_user_limit} активных заданий.")
+        job = ExportJob(user_id, func, args, on_done)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise ExportQueueFull(f"В очереди уже {self.max_size} заданий.")
+        job.recorded = self._record(job, "record_job", job.job_id, user_id, func.__name__, list(args), time.time())
+        self._inflight[key] = [on_done]
+        self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+        return self._queue.qsize()
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            self._running += 1
+            started = time.perf_counter()
+            metrics.observe("export_queue_wait_seconds", started - job.submitted_at,
+                            "Время ожидания задания в очереди")
+            if job.recorded is not None:
+                await job.recorded
+                self._record(job, "start_job", job.job_id, time.time())
+            result, error = None, None
+            try:
+                result = await loop.run_in_executor(self._executor, job.func, *job.args)
+            except Exception as e:
+                error = e
+                metrics.inc("export_jobs_failed_total", help_text="Число заданий экспорта, завершившихся ошибкой")
+            finally:
+                metrics.observe("export_job_seconds", time.perf_counter() - started,
+                                "Время выполнения задания экспорта")
+                self._running -= 1
+                self._release(job.user_id)
+                if job.recorded is not None:
+                    self._record(job, "finish_job", job.job_id, time.time(), result, error)
+            # Результат получают все запросы, присоединенные к заданию. Обработчики (отправка файла)
+            # выполняются отдельными задачами, чтобы воркер сразу взял следующее задание
+            for on_done in self._inflight.pop((job.func, tuple(job.args)), [job.on_done]):
+                task = asyncio.create_task(self._notify(on_done, result, error))
+                self._callbacks.add(task)
+                task.add_done_callback(self._callbacks.discard)
+            self._queue.task_done()
+
+    async def _notify(self, on_done, result, error):
+        try:
+            await on_done(result, error)
+        except Exception as e:
+            logger.error(f"Ошибка в обработчике завершения задания: {e}")
+
+    def _record(self, job, method, *args):
+        """
+        Записывает изменение задания в хранилище в фоновом потоке, не задерживая очередь.
+
+        Записи одного задания выполняются по порядку; ошибка записи не влияет на само задание.
+        """
+        if self.job_store is None:
+            return None
+        previous = job.recorded
+
+        async def write():
+            if previous is not None:
+                await previous
+            try:
+                await asyncio.to_thread(getattr(self.job_store, method), *args)
+            except Exception as e:
+                logger.warning(f"Не удалось записать задание {job.job_id} в хранилище: {e}")
+
+        job.recorded = asyncio.create_task(write())
+        return job.recorded
+
+    def _release(self, user_id):
+        left = self._per_user.get(user_id, 0) - 1
+        if left > 0:
+            self._per_user[user_id] = left
+        else:
+            self._per_user.pop(user_id, None)
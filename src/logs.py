@@ -0,0 +1,246 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, RotatingFileHandler
+from dotenv import load_dotenv
+from src import metrics
+
+load_dotenv()
+
+# Формат строк лога в консоли
+CONSOLE_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+# Сколько записей фоновый поток пишет за один раз
+BATCH_SIZE = 512
+
+# Стандартные атрибуты LogRecord; все остальные попадают в JSON как дополнительные поля
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Форматирует запись в одну строку JSON: time, level, logger, message, поля из extra
+    и текст исключения (exception), если он есть.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class BatchRotatingFileHandler(RotatingFileHandler):
+    """
+    RotatingFileHandler, который умеет записать пачку записей одним вызовом write и одним flush.
+
+    Размер файла проверяется перед каждой пачкой, поэтому файл может превысить max_bytes
+    не больше чем на одну пачку.
+    """
+
+    def emit_batch(self, records):
+        try:
+            data = "".join(self.format(record) + self.terminator for record in records)
+        except Exception:
+            self.handleError(records[0])
+            return
+        with self.lock:
+            try:
+                if self.stream is None:
+                    self.stream = self._open()
+                if self.maxBytes > 0 and self.stream.tell() > 0 and self.stream.tell() + len(data) > self.maxBytes:
+                    self.doRollover()
+                self.stream.write(data)
+                self.stream.flush()
+            except Exception:
+                self.handleError(records[0])
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Кладет записи в ограниченную очередь, никогда не блокируя вызывающий поток:
+    если очередь заполнена (запись на диск не успевает), запись отбрасывается
+    и учитывается в метрике log_records_dropped_total.
+
+    В очередь попадает копия записи с уже подставленными аргументами и текстом исключения;
+    остальное форматирование выполняется в фоновом потоке.
+    """
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc("log_records_dropped_total", help_text="Записи лога, отброшенные из-за заполненной очереди")
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class LogWriter:
+    """
+    Фоновый поток, который забирает записи из очереди пачками и передает их обработчикам.
+
+    Обработчики с методом emit_batch получают пачку целиком, остальные — по одной записи.
+    Пачка — все, что накопилось в очереди к моменту записи (не больше batch_size), поэтому
+    при редких записях задержки нет, а при потоке сообщений запись на диск идет крупными кусками.
+
+    :param log_queue: Очередь записей (ее заполняет NonBlockingQueueHandler).
+    :param handlers: Обработчики, которые выполняют запись.
+    :param batch_size: Максимальное число записей в пачке.
+    """
+
+    _STOP = object()
+
+    def __init__(self, log_queue, handlers, batch_size=BATCH_SIZE):
+        self.queue = log_queue
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Дописывает оставшиеся в очереди записи и останавливает поток."""
+        if self._thread is None:
+            return
+        # Блокирующая вставка: маркер остановки не должен потеряться при заполненной очереди
+        self.queue.put(self._STOP)
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            # Записи, попавшие в очередь после маркера (например, от потоков-демонов при выходе),
+            # дописываются в той же пачке, но поток все равно завершается
+            stop = any(item is self._STOP for item in batch)
+            records = [item for item in batch if item is not self._STOP]
+            if records:
+                self._write(records)
+            if stop:
+                break
+
+    def _write(self, records):
+        for handler in self.handlers:
+            accepted = [record for record in records if record.levelno >= handler.level and handler.filter(record)]
+            if not accepted:
+                continue
+            if hasattr(handler, "emit_batch"):
+                handler.emit_batch(accepted)
+            else:
+                for record in accepted:
+                    handler.handle(record)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Пропускает в среднем не больше rate записей в секунду (с запасом burst подряд).
+
+    Число отброшенных с прошлой пропущенной записи сообщений добавляется к ней в поле suppressed,
+    поэтому поток сообщений виден в логе, даже когда сами сообщения пишутся выборочно.
+
+    :param rate: Записей в секунду; 0 — без ограничения.
+    :param burst: Сколько записей можно пропустить подряд.
+    """
+
+    def __init__(self, rate, burst):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._suppressed = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1:
+                self._suppressed += 1
+                return False
+            self._tokens -= 1
+            if self._suppressed:
+                record.suppressed = self._suppressed
+                self._suppressed = 0
+            return True
+
+
+def init_worker_logging(log_queue):
+    """
+    Инициализатор процесса-воркера экспорта (EXPORT_EXECUTOR=process).
+
+    Унаследованная от родителя очередь записей в дочернем процессе никто не читает, поэтому
+    записи воркера отправляются в очередь между процессами; родитель передает их своим обработчикам
+    (см. ExportQueue.start).
+
+    :param log_queue: Очередь multiprocessing, которую читает QueueListener родительского процесса.
+    """
+    root = logging.getLogger()
+    root.handlers[:] = [NonBlockingQueueHandler(log_queue)]
+    root.setLevel(logging.INFO)
+
+
+def setup_logging():
+    """
+    Настраивает логирование бота: записи из любого потока кладутся в очередь, а фоновый поток
+    пачками пишет их в консоль и в JSON-файл с ротацией по размеру. Цикл событий не ждет диск.
+
+    Переменные окружения: LOG_FILE (по умолчанию bot.log), LOG_MAX_BYTES, LOG_BACKUP_COUNT и LOG_QUEUE_SIZE.
+    Выборочная запись входящих сообщений настраивается отдельно (см. RateLimitFilter).
+
+    :return: LogWriter; он останавливается и дописывает очередь при выходе из процесса.
+    """
+    file_handler = BatchRotatingFileHandler(
+        os.getenv("LOG_FILE", "bot.log"),
+        maxBytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+        backupCount=int(os.getenv("LOG_BACKUP_COUNT", "5")),
+        encoding="utf-8",
+    )
+    file_handler.setFormatter(JsonFormatter())
+    console_handler = logging.StreamHandler(sys.stderr)
+    console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+
+    log_queue = queue.Queue(int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+    writer = LogWriter(log_queue, [file_handler, console_handler])
+    writer.start()
+    atexit.register(writer.stop)
+
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(NonBlockingQueueHandler(log_queue))
+    return writer
@@ -0,0 +1,190 @@
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Границы корзин гистограмм длительностей, в секундах
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Границы корзин для числа строк в отчете
+ROWS_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000, 10000000)
+
+# Сколько последних наблюдений хранить для расчета перцентилей
+QUANTILE_WINDOW = 2048
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Counter:
+    """Монотонно растущий счетчик."""
+
+    kind = "counter"
+
+    def __init__(self, name, labels=()):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def render(self):
+        return [f"{self.name}{_format_labels(self.labels)} {self.value}"]
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными корзинами (для Prometheus) и окном последних
+    наблюдений (для перцентилей p50/p95/p99 в /stats).
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._recent = deque(maxlen=QUANTILE_WINDOW)
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            self._recent.append(value)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.bucket_counts[i] += 1
+
+    def quantile(self, q):
+        """Перцентиль q (0..1) по окну последних наблюдений или None, если наблюдений нет."""
+        with self._lock:
+            values = sorted(self._recent)
+        if not values:
+            return None
+        return values[min(len(values) - 1, math.ceil(q * len(values)) - 1)]
+
+    def render(self):
+        with self._lock:
+            lines = []
+            for bound, count in zip(self.buckets, self.bucket_counts):
+                labels = self.labels + (("le", bound),)
+                lines.append(f"{self.name}_bucket{_format_labels(labels)} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels + (('le', '+Inf'),))} {self.count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels)} {self.sum}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels)} {self.count}")
+        return lines
+
+
+class Registry:
+    """Набор метрик процесса. Метрика создается при первом обращении по имени и меткам."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help_text, labels, **kwargs):
+        labels = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            metric = self._metrics.get((name, labels))
+            if metric is None:
+                metric = self._metrics[(name, labels)] = cls(name, labels, **kwargs)
+                self._help.setdefault(name, (cls.kind, help_text))
+        return metric
+
+    def counter(self, name, help_text="", labels=None):
+        return self._get(Counter, name, help_text, labels)
+
+    def histogram(self, name, help_text="", labels=None, buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help_text, labels, buckets=buckets)
+
+    def metrics(self):
+        with self._lock:
+            return sorted(self._metrics.values(), key=lambda metric: (metric.name, metric.labels))
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus."""
+        lines = []
+        seen = set()
+        for metric in self.metrics():
+            if metric.name not in seen:
+                seen.add(metric.name)
+                kind, help_text = self._help[metric.name]
+                lines.append(f"# HELP {metric.name} {help_text}")
+                lines.append(f"# TYPE {metric.name} {kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Краткая сводка для /stats: перцентили гистограмм и значения счетчиков."""
+        lines = []
+        for metric in self.metrics():
+            name = metric.name + _format_labels(metric.labels)
+            if isinstance(metric, Histogram):
+                if metric.count:
+                    p50, p95, p99 = (metric.quantile(q) for q in (0.5, 0.95, 0.99))
+                    lines.append(f"{name}: n={metric.count} p50={p50:.3g} p95={p95:.3g} p99={p99:.3g}")
+            else:
+                lines.append(f"{name}: {metric.value}")
+        return "\n".join(lines)
+
+
+REGISTRY = Registry()
+
+
+def observe(name, value, help_text="", labels=None, buckets=DEFAULT_BUCKETS):
+    """Добавляет наблюдение в гистограмму name."""
+    REGISTRY.histogram(name, help_text, labels, buckets).observe(value)
+
+
+def inc(name, amount=1, help_text="", labels=None):
+    """Увеличивает счетчик name."""
+    REGISTRY.counter(name, help_text, labels).inc(amount)
+
+
+@contextmanager
+def timer(name, help_text="", labels=None):
+    """Измеряет длительность блока в секундах и записывает ее в гистограмму name."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, help_text, labels)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Запросы сборщика метрик не пишем в лог
+        pass
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """
+    Запускает в фоновом потоке HTTP-сервер, отдающий метрики по адресу http://host:port/metrics.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import telegram
+from telegram import Update
+from telegram.ext import BasePersistence, ConversationHandler, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+# Версия python-telegram-bot, с которой проверена работа SharedConversationHandler с внутренним
+# состоянием ConversationHandler; та же версия закреплена в pyproject.toml
+PTB_TESTED_VERSION = "22.8"
+
+
+class StatePersistence(BasePersistence):
+    """
+    Хранение данных пользователей и состояний диалогов python-telegram-bot в общем хранилище
+    (см. src.state_store): сессии переживают перезапуск и общие для всех процессов бота.
+
+    Перед каждым обновлением данные пользователя перечитываются из хранилища (refresh_user_data),
+    поэтому вход, выполненный через один процесс, сразу виден остальным. Хранятся только данные
+    пользователей и диалоги; данные чатов и бота этим ботом не используются.
+
+    :param store: Хранилище состояния (StateStore).
+    :param update_interval: Как часто приложение сохраняет измененные данные, в секундах.
+    """
+
+    def __init__(self, store, update_interval=60):
+        super().__init__(store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True,
+                                                     callback_data=False),
+                         update_interval=update_interval)
+        self.store = store
+        # Последние сохраненные или прочитанные данные: неизмененные данные не пишутся повторно
+        self._user_data = {}
+
+    async def get_user_data(self):
+        data = await asyncio.to_thread(self.store.load_all, "user_data")
+        self._user_data = {int(user_id): value for user_id, value in data.items()}
+        return {user_id: dict(value) for user_id, value in self._user_data.items()}
+
+    async def update_user_data(self, user_id, data):
+        if self._user_data.get(user_id) == data:
+            return
+        self._user_data[user_id] = dict(data)
+        await asyncio.to_thread(self.store.save, "user_data", user_id, data)
+
+    async def refresh_user_data(self, user_id, user_data):
+        stored = await asyncio.to_thread(self.store.load, "user_data", user_id)
+        if stored is not None and stored != self._user_data.get(user_id):
+            self._user_data[user_id] = dict(stored)
+            user_data.clear()
+            user_data.update(stored)
+
+    async def drop_user_data(self, user_id):
+        self._user_data.pop(user_id, None)
+        await asyncio.to_thread(self.store.drop, "user_data", user_id)
+
+    async def get_conversations(self, name):
+        return await asyncio.to_thread(self.store.load_conversations, name)
+
+    async def update_conversation(self, name, key, new_state):
+        await asyncio.to_thread(self.store.save_conversation, name, key, new_state)
+
+    async def get_chat_data(self):
+        return {}
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def get_bot_data(self):
+        return {}
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def flush(self):
+        pass
+
+
+class SharedConversationHandler(ConversationHandler):
+    """
+    ConversationHandler, состояние которого можно подтянуть из общего хранилища перед обработкой
+    обновления (см. refresh_conversations): диалог, начатый в одном процессе бота, продолжается
+    в любом другом.
+
+    У ConversationHandler нет публичного API для замены состояния диалога, поэтому класс обращается
+    к его внутренним атрибутам. Все такие обращения собраны в методах _conversation_key,
+    _local_state и _set_local_state и проверены с python-telegram-bot PTB_TESTED_VERSION
+    (tests/test_persistence.py); при обновлении библиотеки их нужно проверить в первую очередь.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if telegram.__version__ != PTB_TESTED_VERSION:
+            logger.warning(f"SharedConversationHandler проверен с python-telegram-bot {PTB_TESTED_VERSION}, "
+                           f"установлена {telegram.__version__}")
+
+    async def refresh_state(self, update, store):
+        """Заменяет состояние диалога для update сохраненным в store."""
+        if not self.persistent or not isinstance(update, Update) or not update.effective_chat \
+                or not update.effective_user:
+            return
+        key = self._conversation_key(update)
+        if not isinstance(self._local_state(key), int):
+            # Незавершенный неблокирующий обработчик: состояние еще не известно
+            return
+        state = await asyncio.to_thread(store.load_conversation, self.name, key)
+        self._set_local_state(key, state)
+
+    # Внутреннее API ConversationHandler (см. PTB_TESTED_VERSION)
+
+    def _conversation_key(self, update):
+        return self._get_key(update)
+
+    def _local_state(self, key):
+        # Нет диалога — 0, чтобы отличать его от незавершенного обработчика
+        return self._conversations.get(key, 0)
+
+    def _set_local_state(self, key, state):
+        # Изменение состояния не отмечается для записи: оно и так совпадает с хранилищем
+        if state is None:
+            self._conversations.data.pop(key, None)
+        else:
+            self._conversations.update_no_track({key: state})
+
+
+async def refresh_conversations(update, context):
+    """
+    Обработчик группы -1: перед остальными обработчиками подтягивает из хранилища
+    состояния всех SharedConversationHandler для чата обновления.
+    """
+    persistence = context.application.persistence
+    if not isinstance(persistence, StatePersistence):
+        return
+    for handlers in context.application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, SharedConversationHandler):
+                await handler.refresh_state(update, persistence.store)
+
+
+async def flush_persistence(update, context):
+    """
+    Обработчик последней группы: сразу сохраняет изменения данных и диалогов,
+    чтобы следующее обновление пользователя увидел любой процесс бота.
+    """
+    # Приложение само отмечает данные пользователя только после всех групп обработчиков
+    if isinstance(update, Update) and update.effective_user:
+        context.application.mark_data_for_update_persistence(user_ids=update.effective_user.id)
+    await context.application.update_persistence()
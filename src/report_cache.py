@@ -0,0 +1,135 @@
+import os
+import threading
+from datetime import datetime, time, timedelta
+from dotenv import load_dotenv
+from src.rollup import ROLLUP_LAG_MINUTES
+
+load_dotenv()
+
+# Версия формата отчета: при изменении запроса или оформления увеличьте,
+# чтобы старые файлы перестали считаться актуальными
+REPORT_VERSION = 2
+
+# Запас после конца периода: заказы, записанные с опозданием (время заказа — начало транзакции),
+# должны успеть попасть в базу до того, как собранный отчет станет окончательным. Опоздание заказов
+# оценивается задержкой почасового агрегата, поэтому запас не бывает меньше ROLLUP_LAG_MINUTES
+FINAL_GRACE_SECONDS = max(int(os.getenv("REPORT_FINAL_GRACE_SECONDS", str(ROLLUP_LAG_MINUTES * 60))),
+                          ROLLUP_LAG_MINUTES * 60)
+
+
+# Шаблоны имен файлов для видов отчетов; расширение файла — его формат
+REPORT_FILE_NAMES = {
+    "couriers": "courier_data_{period}_v{version}.{fmt}",
+    "detail": "orders_{period}_v{version}.{fmt}",
+}
+
+# Формат файла по умолчанию для видов отчетов
+DEFAULT_FORMATS = {
+    "couriers": "xlsx",
+    "detail": "csv",
+}
+
+
+def report_key(period_start, period_end, kind="couriers", fmt=None):
+    """Ключ кэша отчета: (вид отчета, формат файла, начало периода, конец периода, версия отчета)."""
+    return kind, fmt or DEFAULT_FORMATS[kind], period_start, period_end, REPORT_VERSION
+
+
+def report_file_name(key):
+    """
+    Имя файла отчета в папке data для ключа кэша.
+
+    Период в пределах одних суток записывается как "14-17_2024-10-01",
+    многодневный — как "2024-10-01_08-2024-10-07_20".
+    """
+    kind, fmt, period_start, period_end, version = key
+    day_start = datetime.combine(period_start.date(), time())
+    if period_end <= day_start + timedelta(days=1):
+        end_hour = int((period_end - day_start).total_seconds() // 3600)
+        period = f"{period_start.hour}-{end_hour}_{period_start:%Y-%m-%d}"
+    else:
+        period = f"{period_start:%Y-%m-%d_%H}-{period_end:%Y-%m-%d_%H}"
+    return REPORT_FILE_NAMES[kind].format(period=period, version=version, fmt=fmt)
+
+
+class ReportCache:
+    """
+    Кэш готовых отчетов о курьерах.
+
+    Отчет за закрытый период (конец периода в прошлом), файл которого сформирован
+    уже после закрытия периода, отдается из кэша без обращения к базе.
+    Отчет за период, захватывающий текущий час, перепроверяется дешевым запросом
+    "водяного знака" (max(orders.cur_time) и число заказов): если он не изменился
+    с момента формирования файла, файл считается актуальным.
+    Наличие и время изменения файлов берутся из индекса хранилища отчетов (ReportStore).
+
+    :param store: Хранилище файлов отчетов.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._watermarks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def lookup(self, key, name, period_end, current_watermark):
+        """
+        Проверяет, можно ли отдать существующий файл отчета.
+
+        :param key: Ключ кэша (см. report_key).
+        :param name: Имя файла отчета в хранилище.
+        :param period_end: Конец периода отчета (datetime).
+        :param current_watermark: Функция без аргументов, возвращающая текущий водяной знак периода.
+        :return: True, если файл актуален.
+        """
+        entry = self.store.lookup(name)
+        if entry is not None:
+            if self._is_final(entry, period_end):
+                self._count("hits")
+                return True
+            with self._lock:
+                stored = self._watermarks.get(key)
+            if stored is not None and stored == current_watermark():
+                self._count("revalidated")
+                return True
+        self._count("misses")
+        return False
+
+    def lookup_final(self, name, period_end):
+        """
+        Проверяет без обращения к базе, есть ли окончательный файл отчета за закрытый период,
+        то есть файл, данные для которого начали читаться позже конца периода с запасом FINAL_GRACE_SECONDS.
+
+        :return: True, если файл можно отдать сразу.
+        """
+        if self.is_final(name, period_end):
+            self._count("hits")
+            return True
+        return False
+
+    def is_final(self, name, period_end):
+        """То же, что lookup_final, но без учета в счетчиках кэша."""
+        entry = self.store.lookup(name)
+        return entry is not None and self._is_final(entry, period_end)
+
+    def remember(self, key, watermark):
+        """Запоминает водяной знак, с которым был сформирован файл отчета."""
+        with self._lock:
+            self._watermarks[key] = watermark
+
+    def stats(self):
+        """Счетчики попаданий и промахов кэша."""
+        with self._lock:
+            return {"hits": self.hits, "revalidated": self.revalidated, "misses": self.misses}
+
+    @staticmethod
+    def _is_final(entry, period_end):
+        # Время изменения файла отчета — момент начала чтения данных (см. export._export_cached):
+        # если чтение началось после конца периода с запасом, файл содержит все данные за период
+        return period_end <= datetime.now() and entry["mtime"] >= period_end.timestamp() + FINAL_GRACE_SECONDS
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
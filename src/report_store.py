@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import asynccontextmanager, contextmanager
+from src import metrics
+
+logger = logging.getLogger(__name__)
+
+# Незавершенные временные файлы (см. writers.atomic_output) старше этого возраста удаляются
+STALE_TMP_SECONDS = 3600
+
+# Срок общего закрепления файла: если процесс упал, не сняв закрепление, файл снова можно удалять
+PIN_TTL_SECONDS = 3600
+
+
+class ReportStore:
+    """
+    Хранилище готовых отчетов в папке на диске с ограничением по объему и возрасту.
+
+    Хранилище ведет индекс файлов (размер, время изменения, время последнего обращения),
+    поэтому поиск готового отчета не требует обращения к файловой системе. Если индекс
+    превышает бюджет, удаляются файлы, к которым дольше всего не обращались; файлы старше
+    max_age удаляются всегда. Файлы, которые сейчас пишутся или отправляются (см. in_use),
+    не удаляются никогда.
+
+    Если папку делят несколько процессов бота, закрепления файлов хранятся еще и в общем хранилище
+    состояния, и файл, закрепленный любым процессом, не удаляется. Поиск отчета в этом режиме
+    сверяется с диском, потому что файлы могут создать или удалить другие процессы.
+
+    :param root: Папка с отчетами.
+    :param max_bytes: Бюджет суммарного размера файлов в байтах.
+    :param max_age: Максимальный возраст файла в секундах.
+    :param state_store: Функция без аргументов, возвращающая общее хранилище состояния
+                        (src.state_store.get_state_store), или None для одного процесса.
+    """
+
+    def __init__(self, root, max_bytes, max_age, state_store=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.state_store = state_store
+        self._index = {}
+        self._pins = Counter()
+        self._lock = threading.RLock()
+        os.makedirs(root, exist_ok=True)
+        self._scan()
+
+    @classmethod
+    def from_env(cls, root, state_store=None):
+        """
+        Создает хранилище с бюджетом из переменных окружения
+        REPORT_STORE_MAX_MB и REPORT_STORE_MAX_AGE_HOURS.
+
+        state_store используется, только если REPORT_STORE_SHARED=1 (папку делят несколько процессов бота):
+        иначе поиск отчетов идет только по индексу, без обращения к диску.
+        """
+        shared = os.getenv("REPORT_STORE_SHARED", "0").lower() in ("1", "true", "yes")
+        return cls(
+            root,
+            max_bytes=int(float(os.getenv("REPORT_STORE_MAX_MB", "500")) * 1024 * 1024),
+            max_age=int(float(os.getenv("REPORT_STORE_MAX_AGE_HOURS", "72")) * 3600),
+            state_store=state_store if shared else None,
+        )
+
+    def path(self, name):
+        """Полный путь к файлу отчета name."""
+        return os.path.join(self.root, name)
+
+    def lookup(self, name):
+        """
+        Возвращает запись индекса {"size", "mtime", "last_access"} для отчета name или None.
+
+        Если файла нет в индексе (например, его записал другой процесс), проверяется диск;
+        при общем хранилище состояния диск проверяется всегда.
+        """
+        with self._lock:
+            entry = self._index.get(name)
+            if entry is None or self.state_store is not None:
+                entry = self._index_file(name)
+            if entry is not None:
+                entry["last_access"] = time.time()
+            return entry
+
+    def add(self, name):
+        """Добавляет в индекс только что записанный файл и приводит хранилище к бюджету."""
+        with self._lock:
+            self._index_file(name)
+        self.enforce()
+
+    def discard(self, name):
+        """Убирает отчет из индекса (например, если файл удален извне)."""
+        with self._lock:
+            self._index.pop(name, None)
+
+    @contextmanager
+    def in_use(self, name):
+        """Защищает файл name от удаления на время записи или отправки."""
+        pin = self.pin(name)
+        try:
+            yield self.path(name)
+        finally:
+            self.unpin(name, pin)
+
+    @asynccontextmanager
+    async def in_use_async(self, name):
+        """То же, что in_use, для цикла событий: общее закрепление пишется в фоновом потоке."""
+        pin = await asyncio.to_thread(self.pin, name)
+        try:
+            yield self.path(name)
+        finally:
+            await asyncio.to_thread(self.unpin, name, pin)
+
+    def pin(self, name):
+        """
+        Закрепляет файл name в этом процессе и, если задано, в общем хранилище состояния.
+
+        :return: Идентификатор общего закрепления для unpin или None.
+        """
+        with self._lock:
+            self._pins[name] += 1
+        if self.state_store is None:
+            return None
+        try:
+            return self.state_store().pin_report(name, PIN_TTL_SECONDS)
+        except Exception as e:
+            # Файл остается закрепленным в этом процессе; другие процессы его не видят
+            logger.warning(f"Не удалось закрепить файл {name} в общем хранилище: {e}")
+            return None
+
+    def unpin(self, name, pin):
+        """Снимает закрепление, полученное от pin."""
+        try:
+            if pin is not None:
+                self.state_store().unpin_report(name, pin)
+        except Exception as e:
+            logger.warning(f"Не удалось снять закрепление файла {name} в общем хранилище: {e}")
+        finally:
+            with self._lock:
+                self._pins[name] -= 1
+                if self._pins[name] <= 0:
+                    del self._pins[name]
+
+    def enforce(self):
+        """
+        Удаляет файлы старше max_age, а затем, пока объем превышает max_bytes,
+        файлы с самым давним обращением. Используемые файлы пропускаются.
+
+        :return: Список имен удаленных файлов.
+        """
+        shared_pins = self._shared_pins()
+        if shared_pins is None:
+            return []
+        evicted = []
+        with self._lock:
+            now = time.time()
+            for name, entry in list(self._index.items()):
+                if now - entry["mtime"] > self.max_age and self._remove(name, shared_pins):
+                    evicted.append(name)
+
+            total = sum(entry["size"] for entry in self._index.values())
+            for name, entry in sorted(self._index.items(), key=lambda item: item[1]["last_access"]):
+                if total <= self.max_bytes:
+                    break
+                size = entry["size"]
+                if self._remove(name, shared_pins):
+                    evicted.append(name)
+                    total -= size
+        if evicted:
+            metrics.inc("report_store_evictions_total", len(evicted), "Число удаленных из хранилища отчетов")
+        return evicted
+
+    def stats(self):
+        """Число файлов, их суммарный объем и число используемых сейчас файлов."""
+        with self._lock:
+            return {
+                "files": len(self._index),
+                "bytes": sum(entry["size"] for entry in self._index.values()),
+                "in_use": len(self._pins),
+            }
+
+    def _scan(self):
+        with self._lock:
+            for name in os.listdir(self.root):
+                if not name.startswith("."):
+                    self._index_file(name)
+
+    def _index_file(self, name):
+        try:
+            stat = os.stat(self.path(name))
+        except FileNotFoundError:
+            self._index.pop(name, None)
+            return None
+        entry = self._index.get(name, {"last_access": stat.st_mtime})
+        entry.update(size=stat.st_size, mtime=stat.st_mtime)
+        self._index[name] = entry
+        return entry
+
+    def _shared_pins(self):
+        # Файлы, закрепленные другими процессами; None — закрепления неизвестны и удалять ничего нельзя
+        if self.state_store is None:
+            return set()
+        try:
+            return self.state_store().pinned_reports()
+        except Exception as e:
+            logger.warning(f"Не удалось получить закрепления файлов из общего хранилища, очистка пропущена: {e}")
+            return None
+
+    def _remove(self, name, shared_pins=()):
+        if self._pins.get(name) or name in shared_pins:
+            return False
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+        except PermissionError:
+            logger.warning(f"Недостаточно прав для удаления файла {name}.")
+            return False
+        self._index.pop(name, None)
+        return True
+
+    def remove_stale_tmp(self):
+        """Удаляет временные файлы, оставшиеся от прерванной записи."""
+        now = time.time()
+        for name in os.listdir(self.root):
+            if name.startswith(".") and name.endswith(".tmp"):
+                path = self.path(name)
+                try:
+                    if now - os.path.getmtime(path) > STALE_TMP_SECONDS:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
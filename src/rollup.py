@@ -0,0 +1,172 @@
+import logging
+import os
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from src import metrics
+from src.db_pool import execute_prepared, get_pool
+from src.bot_db import COURIER_TOTALS_SQL, ROLLUP_TOTALS_SQL
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Имя строки в rollup_watermark для почасового агрегата
+ROLLUP_NAME = "courier_hourly"
+
+# Час попадает в агрегат не раньше, чем через столько минут после своего конца: время заказа — начало
+# транзакции, и заказ может появиться в таблице позже, чем заказы с более поздним временем
+ROLLUP_LAG_MINUTES = int(os.getenv("ROLLUP_LAG_MINUTES", "15"))
+
+# Сколько последних часов агрегата сверяется с orders и при расхождении пересчитывается
+ROLLUP_CHECK_HOURS = int(os.getenv("ROLLUP_CHECK_HOURS", "3"))
+
+ROLLUP_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS courier_hourly_rollup (
+    day DATE NOT NULL,
+    hour SMALLINT NOT NULL,
+    courier_id BIGINT NOT NULL,
+    orders_count BIGINT NOT NULL,
+    time_taken_sum NUMERIC,
+    PRIMARY KEY (day, hour, courier_id)
+);
+-- NULL, если у всех заказов часа нет time_taken: так же, как SUM по orders.
+-- Таблица, созданная прежней версией, меняется один раз, чтобы не брать блокировку при каждом обновлении
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_name = 'courier_hourly_rollup' AND column_name = 'time_taken_sum'
+                 AND is_nullable = 'NO') THEN
+        ALTER TABLE courier_hourly_rollup ALTER COLUMN time_taken_sum DROP NOT NULL;
+    END IF;
+END $$;
+CREATE TABLE IF NOT EXISTS rollup_watermark (
+    name TEXT PRIMARY KEY,
+    last_cur_time TIMESTAMP NOT NULL
+);
+INSERT INTO rollup_watermark (name, last_cur_time) VALUES (%s, '-infinity')
+ON CONFLICT (name) DO NOTHING;
+"""
+
+# Пересчитывает агрегат за целые часы [st, en): удаляет строки этих часов и заново считает их по orders
+ROLLUP_REBUILD_SQL = """
+DELETE FROM courier_hourly_rollup
+WHERE day BETWEEN %(st)s::date AND %(en)s::date
+  AND day + make_interval(hours => hour) >= %(st)s AND day + make_interval(hours => hour) < %(en)s;
+INSERT INTO courier_hourly_rollup (day, hour, courier_id, orders_count, time_taken_sum)
+SELECT cur_time::date, EXTRACT(HOUR FROM cur_time)::smallint, courier_id,
+       COUNT(order_id), SUM(time_taken)::numeric
+FROM orders
+WHERE cur_time >= %(st)s AND cur_time < %(en)s
+GROUP BY 1, 2, 3;
+"""
+
+# Начало первого еще не обработанного часа: час водяного знака или, при первом запуске, час самого старого заказа
+ROLLUP_START_SQL = """SELECT CASE WHEN last_cur_time = '-infinity'
+                    THEN (SELECT date_trunc('hour', MIN(cur_time)) FROM orders)
+                    ELSE date_trunc('hour', last_cur_time) END
+                FROM rollup_watermark WHERE name = %s FOR UPDATE"""
+
+
+def ensure_rollup_schema():
+    """Создает таблицы почасового агрегата и водяного знака, если их еще нет."""
+    with get_pool().connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(ROLLUP_SCHEMA_SQL, (ROLLUP_NAME,))
+        connection.commit()
+
+
+def refresh_hourly_rollup():
+    """
+    Дополняет агрегат courier_hourly_rollup закрытыми часами.
+
+    Водяной знак — начало первого часа, которого еще нет в агрегате. Часы от водяного знака до часа,
+    закончившегося не меньше ROLLUP_LAG_MINUTES минут назад, считаются по orders целиком и заменяют
+    строки агрегата, поэтому повторный пересчет ничего не удваивает. Строка водяного знака блокируется
+    на время транзакции, поэтому параллельные обновления не мешают друг другу.
+
+    :return: Новый водяной знак или None, если закрытых часов не добавилось.
+    """
+    ensure_rollup_schema()
+    new_watermark = (datetime.now() - timedelta(minutes=ROLLUP_LAG_MINUTES)).replace(minute=0, second=0,
+                                                                                     microsecond=0)
+    with get_pool().connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(ROLLUP_START_SQL, (ROLLUP_NAME,))
+            start = cursor.fetchone()[0]
+            if start is None or start >= new_watermark:
+                connection.rollback()
+                return None
+            cursor.execute(ROLLUP_REBUILD_SQL, {"st": start, "en": new_watermark})
+            cursor.execute("UPDATE rollup_watermark SET last_cur_time = %s WHERE name = %s",
+                           (new_watermark, ROLLUP_NAME))
+        connection.commit()
+    logger.info(f"Почасовой агрегат обновлен до {new_watermark}.")
+    return new_watermark
+
+
+def repair_rollup(period_start, period_end):
+    """
+    Пересчитывает по orders часы агрегата в периоде, уже попавшие в агрегат (до водяного знака).
+
+    :param period_start: Начало периода (datetime, выровнено по часу).
+    :param period_end: Конец периода (datetime, выровнен по часу).
+    :return: Конец пересчитанного периода или None, если пересчитывать нечего.
+    """
+    with get_pool().connection() as connection:
+        with connection.cursor() as cursor:
+            # Блокировка водяного знака: пересчет не пересекается с обновлением агрегата
+            cursor.execute("SELECT last_cur_time FROM rollup_watermark "
+                           "WHERE name = %s AND last_cur_time > '-infinity' FOR UPDATE", (ROLLUP_NAME,))
+            row = cursor.fetchone()
+            end = min(period_end, row[0]) if row is not None else None
+            if end is None or end <= period_start:
+                connection.rollback()
+                return None
+            cursor.execute(ROLLUP_REBUILD_SQL, {"st": period_start, "en": end})
+        connection.commit()
+    return end
+
+
+def check_rollup_consistency(period_start, period_end):
+    """
+    Сравнивает отчет по агрегату с отчетом по исходной таблице orders за период.
+
+    :param period_start: Начало периода (datetime).
+    :param period_end: Конец периода (datetime, не включительно).
+    :return: Список расхождений (courier_id, (кол-во, сумма) по orders, (кол-во, сумма) по агрегату).
+    """
+    results = []
+    with get_pool().connection() as connection:
+        with connection.cursor() as cursor:
+            for name, sql in (("courier_totals", COURIER_TOTALS_SQL), ("courier_totals_rollup", ROLLUP_TOTALS_SQL)):
+                execute_prepared(cursor, name, sql, (period_start, period_end))
+                results.append({row[0]: (row[2], row[3]) for row in cursor.fetchall()})
+    raw, rolled = results
+
+    # Сумма NULL (нет ни одного time_taken) и 0 дают в отчете разное среднее, поэтому сравниваются как есть
+    mismatches = []
+    for courier_id in sorted(set(raw) | set(rolled)):
+        raw_totals = raw.get(courier_id, (0, None))
+        rolled_totals = rolled.get(courier_id, (0, None))
+        if raw_totals != rolled_totals:
+            mismatches.append((courier_id, raw_totals, rolled_totals))
+    return mismatches
+
+
+def scheduled_rollup_check():
+    """
+    Сверяет агрегат за последние ROLLUP_CHECK_HOURS закрытых часов с таблицей orders
+    и при расхождении пересчитывает эти часы.
+    """
+    period_end = datetime.now().replace(minute=0, second=0, microsecond=0)
+    period_start = period_end - timedelta(hours=ROLLUP_CHECK_HOURS)
+    mismatches = check_rollup_consistency(period_start, period_end)
+    if not mismatches:
+        logger.info(f"Агрегат за {period_start}-{period_end} согласован с таблицей orders.")
+        return
+    metrics.inc("rollup_mismatches_total", len(mismatches),
+                help_text="Курьеры, итоги которых в агрегате разошлись с таблицей orders при сверке")
+    logger.warning(f"Расхождения агрегата за {period_start}-{period_end}: {mismatches}")
+    repaired_to = repair_rollup(period_start, period_end)
+    if repaired_to is not None:
+        logger.info(f"Агрегат за {period_start}-{repaired_to} пересчитан по таблице orders.")
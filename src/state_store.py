@@ -0,0 +1,305 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from src import metrics
+from src.db_pool import ConnectionPool, db_config_from_env
+
+load_dotenv()
+
+# Таблицы общего состояния ботов; SQL подходит и для SQLite, и для PostgreSQL
+STATE_SCHEMA_SQL = [
+    """CREATE TABLE IF NOT EXISTS bot_state (
+        kind TEXT NOT NULL,
+        id TEXT NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (kind, id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS bot_conversations (
+        name TEXT NOT NULL,
+        conversation_key TEXT NOT NULL,
+        state TEXT NOT NULL,
+        PRIMARY KEY (name, conversation_key)
+    )""",
+    """CREATE TABLE IF NOT EXISTS export_jobs (
+        job_id TEXT PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        kind TEXT NOT NULL,
+        args TEXT NOT NULL,
+        worker TEXT NOT NULL,
+        status TEXT NOT NULL,
+        submitted_at DOUBLE PRECISION NOT NULL,
+        started_at DOUBLE PRECISION,
+        finished_at DOUBLE PRECISION,
+        result TEXT,
+        error TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS export_jobs_submitted_at_idx ON export_jobs (submitted_at)",
+    """CREATE TABLE IF NOT EXISTS report_leases (
+        name TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        expires_at DOUBLE PRECISION NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS report_pins (
+        name TEXT NOT NULL,
+        owner TEXT NOT NULL,
+        expires_at DOUBLE PRECISION NOT NULL,
+        PRIMARY KEY (name, owner)
+    )""",
+]
+
+# Аренда достается, если ее нет, она просрочена или уже принадлежит этому владельцу
+LEASE_ACQUIRE_SQL = """INSERT INTO report_leases (name, owner, expires_at) VALUES (%s, %s, %s)
+                ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                WHERE report_leases.expires_at < %s OR report_leases.owner = excluded.owner"""
+
+# Идентификатор процесса в записях заданий и аренд
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class LeaseTimeout(Exception):
+    """Не удалось получить аренду за отведенное время."""
+
+
+class StateStore:
+    """
+    Общее хранилище состояния ботов: данные пользователей, состояния диалогов, file_id отправленных отчетов,
+    записи о заданиях экспорта, аренды на формирование отчетов и закрепления файлов отчетов.
+
+    Несколько процессов бота (на одной машине — с SQLite, на разных — с PostgreSQL)
+    видят одни и те же сессии и не формируют один и тот же отчет одновременно.
+    Значения хранятся в JSON. Запросы пишутся с плейсхолдерами %s; подклассы
+    реализуют _execute для своей базы.
+    """
+
+    def ensure_schema(self):
+        """Создает таблицы состояния, если их еще нет."""
+        for sql in STATE_SCHEMA_SQL:
+            self._execute(sql)
+
+    # Данные пользователей, чатов и бота
+
+    def load_all(self, kind):
+        """Все записи вида kind ("user_data", "chat_data", "bot_data", "file_id") как {id: данные}."""
+        rows = self._execute("SELECT id, data FROM bot_state WHERE kind = %s", (kind,), fetch=True)
+        return {row[0]: json.loads(row[1]) for row in rows}
+
+    def load(self, kind, id):
+        """Данные записи вида kind с идентификатором id или None."""
+        rows = self._execute("SELECT data FROM bot_state WHERE kind = %s AND id = %s", (kind, str(id)), fetch=True)
+        return json.loads(rows[0][0]) if rows else None
+
+    def save(self, kind, id, data):
+        """Сохраняет данные записи (значения должны сериализоваться в JSON)."""
+        self._execute("""INSERT INTO bot_state (kind, id, data) VALUES (%s, %s, %s)
+                         ON CONFLICT (kind, id) DO UPDATE SET data = excluded.data""",
+                      (kind, str(id), json.dumps(data, ensure_ascii=False)))
+
+    def drop(self, kind, id):
+        """Удаляет запись."""
+        self._execute("DELETE FROM bot_state WHERE kind = %s AND id = %s", (kind, str(id)))
+
+    # Состояния диалогов (ConversationHandler)
+
+    def load_conversations(self, name):
+        """Все состояния диалога name как {ключ диалога (кортеж): состояние}."""
+        rows = self._execute("SELECT conversation_key, state FROM bot_conversations WHERE name = %s", (name,),
+                             fetch=True)
+        return {tuple(json.loads(row[0])): json.loads(row[1]) for row in rows}
+
+    def load_conversation(self, name, key):
+        """Состояние диалога name для ключа key или None, если диалог не идет."""
+        rows = self._execute("SELECT state FROM bot_conversations WHERE name = %s AND conversation_key = %s",
+                             (name, json.dumps(list(key))), fetch=True)
+        return json.loads(rows[0][0]) if rows else None
+
+    def save_conversation(self, name, key, state):
+        """Сохраняет состояние диалога; None завершает диалог."""
+        if state is None:
+            self._execute("DELETE FROM bot_conversations WHERE name = %s AND conversation_key = %s",
+                          (name, json.dumps(list(key))))
+        else:
+            self._execute("""INSERT INTO bot_conversations (name, conversation_key, state) VALUES (%s, %s, %s)
+                             ON CONFLICT (name, conversation_key) DO UPDATE SET state = excluded.state""",
+                          (name, json.dumps(list(key)), json.dumps(state)))
+
+    # Записи о заданиях экспорта
+
+    def record_job(self, job_id, user_id, kind, args, submitted_at):
+        """Записывает поставленное в очередь задание."""
+        self._execute("""INSERT INTO export_jobs (job_id, user_id, kind, args, worker, status, submitted_at)
+                         VALUES (%s, %s, %s, %s, %s, 'queued', %s)""",
+                      (job_id, user_id, kind, json.dumps(args, default=str, ensure_ascii=False), WORKER_ID,
+                       submitted_at))
+
+    def start_job(self, job_id, started_at):
+        """Отмечает начало выполнения задания."""
+        self._execute("UPDATE export_jobs SET status = 'running', started_at = %s WHERE job_id = %s",
+                      (started_at, job_id))
+
+    def finish_job(self, job_id, finished_at, result=None, error=None):
+        """Отмечает завершение задания: status 'done' с результатом или 'failed' с ошибкой."""
+        self._execute("UPDATE export_jobs SET status = %s, finished_at = %s, result = %s, error = %s "
+                      "WHERE job_id = %s",
+                      ("failed" if error is not None else "done", finished_at, result,
+                       None if error is None else str(error), job_id))
+
+    def job_stats(self, since):
+        """Число заданий по статусам, поставленных не раньше since (unix time), по всем процессам."""
+        rows = self._execute("SELECT status, COUNT(*) FROM export_jobs WHERE submitted_at >= %s GROUP BY status",
+                             (since,), fetch=True)
+        return {row[0]: row[1] for row in rows}
+
+    # Аренды
+
+    def try_acquire_lease(self, name, owner, ttl):
+        """Пытается получить аренду name на ttl секунд; возвращает True при успехе."""
+        now = time.time()
+        return self._execute(LEASE_ACQUIRE_SQL, (name, owner, now + ttl, now), rowcount=True) > 0
+
+    def release_lease(self, name, owner):
+        """Освобождает аренду, если она все еще принадлежит owner."""
+        self._execute("DELETE FROM report_leases WHERE name = %s AND owner = %s", (name, owner))
+
+    @contextmanager
+    def lease(self, name, ttl=600, wait=None, poll=0.2):
+        """
+        Выполняет блок, удерживая аренду name: пока аренда у одного процесса,
+        остальные ждут ее освобождения или истечения ttl.
+
+        :param ttl: Срок аренды в секундах; должен превышать время выполнения блока.
+        :param wait: Сколько ждать аренду, по умолчанию ttl.
+        :param poll: Интервал повторных попыток в секундах.
+        :raises LeaseTimeout: Если аренду не удалось получить за wait секунд.
+        """
+        owner = f"{WORKER_ID}:{uuid.uuid4().hex[:8]}"
+        started = time.perf_counter()
+        deadline = time.monotonic() + (ttl if wait is None else wait)
+        while not self.try_acquire_lease(name, owner, ttl):
+            if time.monotonic() >= deadline:
+                raise LeaseTimeout(f"Аренда {name} занята дольше {ttl if wait is None else wait} с.")
+            time.sleep(poll)
+        metrics.observe("lease_wait_seconds", time.perf_counter() - started, "Время ожидания аренды на отчет")
+        try:
+            yield
+        finally:
+            self.release_lease(name, owner)
+
+    # Закрепления файлов отчетов (см. ReportStore.in_use)
+
+    def pin_report(self, name, ttl):
+        """
+        Закрепляет файл отчета name на ttl секунд: пока закрепление есть, хранилище отчетов
+        любого процесса его не удаляет.
+
+        :return: Идентификатор закрепления для unpin_report.
+        """
+        owner = f"{WORKER_ID}:{uuid.uuid4().hex[:8]}"
+        self._execute("INSERT INTO report_pins (name, owner, expires_at) VALUES (%s, %s, %s)",
+                      (name, owner, time.time() + ttl))
+        return owner
+
+    def unpin_report(self, name, owner):
+        """Снимает закрепление файла отчета."""
+        self._execute("DELETE FROM report_pins WHERE name = %s AND owner = %s", (name, owner))
+
+    def pinned_reports(self):
+        """Имена файлов отчетов, закрепленных каким-либо процессом; просроченные закрепления удаляются."""
+        now = time.time()
+        self._execute("DELETE FROM report_pins WHERE expires_at < %s", (now,))
+        rows = self._execute("SELECT DISTINCT name FROM report_pins WHERE expires_at >= %s", (now,), fetch=True)
+        return {row[0] for row in rows}
+
+    def _execute(self, sql, params=(), fetch=False, rowcount=False):
+        raise NotImplementedError
+
+
+class SQLiteStateStore(StateStore):
+    """
+    Хранилище состояния в файле SQLite (по умолчанию). Подходит для нескольких процессов
+    на одной машине: база открывается в режиме WAL, конкурентные записи ждут до timeout секунд.
+
+    :param path: Путь к файлу базы.
+    """
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self._connection = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._lock = threading.Lock()
+        self.ensure_schema()
+
+    def _execute(self, sql, params=(), fetch=False, rowcount=False):
+        with self._lock:
+            cursor = self._connection.execute(sql.replace("%s", "?"), params)
+            if fetch:
+                return cursor.fetchall()
+            return cursor.rowcount if rowcount else None
+
+
+class PostgresStateStore(StateStore):
+    """
+    Хранилище состояния в PostgreSQL (той же базе, что и заказы). Подходит для процессов бота на разных машинах.
+
+    У хранилища свой небольшой пул соединений: его запросы выполняются на каждое обновление
+    и не должны ждать, пока долгие выгрузки заняты всеми соединениями пула экспорта.
+    Размер пула задается переменной STATE_DB_POOL_MAX.
+    """
+
+    def __init__(self, maxconn=None):
+        self.maxconn = maxconn or int(os.getenv("STATE_DB_POOL_MAX", "2"))
+        self._pool = None
+        self._schema_ready = False
+        self._init_lock = threading.Lock()
+
+    def _execute(self, sql, params=(), fetch=False, rowcount=False):
+        # Пул и таблицы создаются при первом обращении, а не при импорте; при ошибке — повторно в следующий раз
+        if not self._schema_ready:
+            with self._init_lock:
+                if not self._schema_ready:
+                    for schema_sql in STATE_SCHEMA_SQL:
+                        self._run(schema_sql)
+                    self._schema_ready = True
+        return self._run(sql, params, fetch, rowcount)
+
+    def _run(self, sql, params=(), fetch=False, rowcount=False):
+        if self._pool is None:
+            self._pool = ConnectionPool(1, self.maxconn, **db_config_from_env())
+        with self._pool.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                result = cursor.fetchall() if fetch else (cursor.rowcount if rowcount else None)
+            connection.commit()
+        return result
+
+
+_store = None
+_store_pid = None
+_store_lock = threading.Lock()
+
+
+def get_state_store():
+    """
+    Возвращает общее хранилище состояния процесса, создавая его при первом обращении.
+
+    Вид хранилища задается переменной STATE_BACKEND: sqlite (по умолчанию, файл STATE_SQLITE_PATH)
+    или postgres.
+    """
+    global _store, _store_pid
+    with _store_lock:
+        # Соединение SQLite нельзя использовать в дочернем процессе (EXPORT_EXECUTOR=process)
+        if _store is None or _store_pid != os.getpid():
+            _store_pid = os.getpid()
+            backend = os.getenv("STATE_BACKEND", "sqlite")
+            if backend == "postgres":
+                _store = PostgresStateStore()
+            elif backend == "sqlite":
+                _store = SQLiteStateStore(os.getenv("STATE_SQLITE_PATH", "bot_state.sqlite3"))
+            else:
+                raise ValueError(f"Неизвестное хранилище состояния STATE_BACKEND={backend}")
+        return _store
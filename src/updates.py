@@ -0,0 +1,43 @@
+import asyncio
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обрабатывает обновления параллельно, но не больше max_concurrent_updates одновременно
+    и строго по очереди в пределах одного чата.
+
+    ConversationHandler рассчитывает на то, что обновления одного пользователя приходят
+    одно за другим, поэтому обновления одного чата выполняются последовательно, а разные
+    чаты не ждут друг друга. Обновления без чата обрабатываются без упорядочивания.
+    Обновление, ждущее своей очереди в чате, уже занимает место в пределе max_concurrent_updates.
+
+    :param max_concurrent_updates: Максимальное число одновременно обрабатываемых обновлений.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._chat_locks = {}
+
+    async def do_process_update(self, update, coroutine):
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            await coroutine
+            return
+        # Блокировка чата живет, пока у чата есть обновления в работе: [блокировка, число ожидающих]
+        entry = self._chat_locks.setdefault(chat.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chat_locks[chat.id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
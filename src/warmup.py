@@ -0,0 +1,108 @@
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from src import metrics
+from src.export import export2xlsx
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Диапазоны, которые готовятся заранее: "last" — только что закрывшийся час, "8-12" — блок часов смены
+WARMUP_RANGES = [item.strip() for item in os.getenv("WARMUP_RANGES", "last,8-12,12-16,16-20,20-24").split(",")
+                 if item.strip()]
+
+# Приоритет (nice) потока прогрева: отчеты готовятся в фоне, не мешая запросам пользователей
+WARMUP_NICE = int(os.getenv("WARMUP_NICE", "10"))
+
+_requests = {}
+_requests_lock = threading.Lock()
+
+
+def warmup_periods(now=None):
+    """
+    Возвращает последние закрывшиеся периоды для настроенных диапазонов.
+
+    :param now: Текущее время, по умолчанию datetime.now().
+    :return: Список (диапазон, начало, конец).
+    """
+    now = now or datetime.now()
+    current_hour = now.replace(minute=0, second=0, microsecond=0)
+    today = current_hour.replace(hour=0)
+    periods = []
+    for spec in WARMUP_RANGES:
+        if spec == "last":
+            periods.append((spec, current_hour - timedelta(hours=1), current_hour))
+            continue
+        st_point, end_point = map(int, spec.split("-"))
+        day = today if today + timedelta(hours=end_point) <= current_hour else today - timedelta(days=1)
+        periods.append((spec, day + timedelta(hours=st_point), day + timedelta(hours=end_point)))
+    return periods
+
+
+def match_range(period_start, period_end, now=None):
+    """Возвращает настроенный диапазон, последнему периоду которого соответствует запрос, или None."""
+    for spec, start, end in warmup_periods(now):
+        if (start, end) == (period_start, period_end):
+            return spec
+    return None
+
+
+def warm_reports():
+    """
+    Заранее формирует отчеты по курьерам для настроенных диапазонов.
+
+    Запускается планировщиком вскоре после начала каждого часа. Отчеты строятся
+    последовательно в отдельном потоке с пониженным приоритетом (поток планировщика ждет его
+    завершения); уже готовые отчеты берутся из кэша без обращения к базе.
+    """
+    # Приоритет понижается у короткоживущего потока: потоки пула планировщика переиспользуются
+    # другими задачами, а вернуть им прежний приоритет без прав root нельзя
+    thread = threading.Thread(target=_warm_reports_low_priority, name="warmup")
+    thread.start()
+    thread.join()
+
+
+def _warm_reports_low_priority():
+    _lower_thread_priority()
+    for spec, period_start, period_end in warmup_periods():
+        try:
+            export2xlsx(period_start, period_end)
+            metrics.inc("warmup_builds_total", help_text="Число отчетов, подготовленных заранее",
+                        labels={"range": spec})
+        except Exception as e:
+            logger.warning(f"Не удалось заранее подготовить отчет {spec}: {e}")
+
+
+def record_request(period_start, period_end, prebuilt):
+    """
+    Учитывает запрос пользователя для статистики попаданий в заранее подготовленные отчеты.
+
+    :param prebuilt: True, если запрос был обслужен готовым файлом без формирования отчета.
+    """
+    spec = match_range(period_start, period_end)
+    if spec is None:
+        return
+    result = "hit" if prebuilt else "miss"
+    metrics.inc("warmup_requests_total", help_text="Запросы настроенных диапазонов: hit — отчет был готов заранее",
+                labels={"range": spec, "result": result})
+    with _requests_lock:
+        counts = _requests.setdefault(spec, {"hit": 0, "miss": 0})
+        counts[result] += 1
+
+
+def hit_rates():
+    """Доля запросов, обслуженных заранее подготовленными файлами, по каждому диапазону."""
+    with _requests_lock:
+        return {spec: {**counts, "rate": round(counts["hit"] / (counts["hit"] + counts["miss"]), 3)}
+                for spec, counts in _requests.items()}
+
+
+def _lower_thread_priority():
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), WARMUP_NICE)
+    except (AttributeError, OSError):
+        # Не на Linux приоритет отдельного потока изменить нельзя
+        pass
@@ -0,0 +1,228 @@
+import asyncio
+import hmac
+import json
+import logging
+import os
+import signal
+import time
+from dotenv import load_dotenv
+from telegram import Update
+from src import metrics
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+_REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+            411: "Length Required", 413: "Payload Too Large", 503: "Service Unavailable"}
+
+
+class WebhookServer:
+    """
+    Локальный HTTP-сервер, принимающий обновления Telegram через вебхук.
+
+    Обновление из POST-запроса на path сразу передается в процессор обновлений приложения
+    (тот же, что и при опросе), а ответ отправляется после его обработки: так Telegram
+    не присылает новые обновления быстрее, чем бот их обрабатывает. Если обновлений
+    в работе уже max_pending, запрос отклоняется с кодом 503 и Telegram повторит его позже.
+    GET /healthz возвращает состояние сервера в JSON.
+
+    :param application: Приложение python-telegram-bot (должно быть инициализировано до start).
+    :param host: Адрес, на котором слушает сервер.
+    :param port: Порт сервера.
+    :param path: Путь, на который Telegram отправляет обновления.
+    :param secret_token: Секрет из заголовка X-Telegram-Bot-Api-Secret-Token (None — без проверки).
+    :param max_pending: Максимальное число принятых, но еще не обработанных обновлений.
+    :param max_body: Максимальный размер тела запроса в байтах.
+    :param health: Функция без аргументов, возвращающая дополнительные поля для /healthz.
+    """
+
+    def __init__(self, application, host="127.0.0.1", port=8443, path="/telegram", secret_token=None,
+                 max_pending=100, max_body=1024 * 1024, health=None):
+        self.application = application
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.max_pending = max_pending
+        self.max_body = max_body
+        self.health = health
+        self.pending = 0
+        self._server = None
+
+    @classmethod
+    def from_env(cls, application, health=None):
+        """
+        Создает сервер с параметрами из переменных окружения
+        WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET и WEBHOOK_MAX_PENDING.
+        """
+        return cls(
+            application,
+            host=os.getenv("WEBHOOK_HOST", "127.0.0.1"),
+            port=int(os.getenv("WEBHOOK_PORT", "8443")),
+            path=os.getenv("WEBHOOK_PATH", "/telegram"),
+            secret_token=os.getenv("WEBHOOK_SECRET") or None,
+            max_pending=int(os.getenv("WEBHOOK_MAX_PENDING", "100")),
+            health=health,
+        )
+
+    async def start(self):
+        """Начинает принимать соединения. Должна вызываться внутри работающего цикла событий."""
+        self._server = await asyncio.start_server(self._serve_connection, self.host, self.port)
+        # При port=0 порт выбирает система
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """Перестает принимать соединения и закрывает сервер."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve_connection(self, reader, writer):
+        # Соединение обслуживается, пока клиент его не закроет (HTTP/1.1 keep-alive)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                keep_alive = version.strip() == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                length = int(headers.get("content-length", "0"))
+                if length > self.max_body:
+                    # Тело запроса не читается, поэтому соединение дальше использовать нельзя
+                    status, body, extra, keep_alive = 413, {"error": "payload too large"}, {}, False
+                else:
+                    data = await reader.readexactly(length) if length else b""
+                    status, body, extra = await self._dispatch(method, target.split("?", 1)[0], headers, data)
+                writer.write(_response(status, body, extra, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ValueError, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method, path, headers, data):
+        if path == "/healthz":
+            if method != "GET":
+                return 405, {"error": "method not allowed"}, {}
+            return 200, self._health(), {}
+        if path != self.path:
+            return 404, {"error": "not found"}, {}
+        if method != "POST":
+            return 405, {"error": "method not allowed"}, {}
+        if "content-length" not in headers:
+            return 411, {"error": "content-length required"}, {}
+        if self.secret_token is not None and not hmac.compare_digest(
+                headers.get("x-telegram-bot-api-secret-token", ""), self.secret_token):
+            metrics.inc("webhook_rejected_total", help_text="Отклоненные запросы вебхука", labels={"reason": "secret"})
+            return 403, {"error": "forbidden"}, {}
+        try:
+            payload = json.loads(data)
+            update = Update.de_json(payload, self.application.bot) if isinstance(payload, dict) else None
+        except (ValueError, TypeError, KeyError):
+            update = None
+        if update is None:
+            metrics.inc("webhook_rejected_total", help_text="Отклоненные запросы вебхука", labels={"reason": "json"})
+            return 400, {"error": "bad json"}, {}
+        if self.pending >= self.max_pending:
+            metrics.inc("webhook_rejected_total", help_text="Отклоненные запросы вебхука", labels={"reason": "busy"})
+            return 503, {"error": "busy"}, {"Retry-After": "1"}
+
+        self.pending += 1
+        started = time.perf_counter()
+        try:
+            await self.application.update_processor.process_update(
+                update, self.application.process_update(update))
+        except Exception as e:
+            # Ошибки обработчиков уже переданы обработчикам ошибок приложения; повторная доставка не поможет
+            logger.error(f"Ошибка обработки обновления {update.update_id}: {e}")
+        finally:
+            self.pending -= 1
+            metrics.observe("webhook_update_seconds", time.perf_counter() - started,
+                            "Время от приема обновления вебхуком до конца его обработки")
+        return 200, {"ok": True}, {}
+
+    def _health(self):
+        processor = self.application.update_processor
+        state = {
+            "status": "ok",
+            "pending": self.pending,
+            "processing": processor.current_concurrent_updates,
+            "max_concurrent_updates": processor.max_concurrent_updates,
+        }
+        if self.health is not None:
+            state.update(self.health())
+        return state
+
+
+def _response(status, body, extra_headers, keep_alive):
+    payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+    lines = [
+        f"HTTP/1.1 {status} {_REASONS[status]}",
+        "Content-Type: application/json; charset=utf-8",
+        f"Content-Length: {len(payload)}",
+        f"Connection: {'keep-alive' if keep_alive else 'close'}",
+    ]
+    lines.extend(f"{name}: {value}" for name, value in extra_headers.items())
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + payload
+
+
+async def serve(application, server, webhook_url=None, max_connections=40):
+    """
+    Запускает приложение в режиме вебхука и работает до SIGINT/SIGTERM.
+
+    Порядок запуска и остановки повторяет run_polling: initialize, post_init, start и
+    stop, post_stop, shutdown, post_shutdown.
+
+    :param application: Приложение python-telegram-bot.
+    :param server: WebhookServer для этого приложения.
+    :param webhook_url: Внешний адрес (например, обратного прокси), по которому Telegram доступен сервер.
+                        Если задан, вебхук регистрируется в Telegram при запуске.
+    :param max_connections: Сколько одновременных соединений Telegram может открыть к вебхуку.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await application.initialize()
+    if application.post_init is not None:
+        await application.post_init(application)
+    await application.start()
+    await server.start()
+    try:
+        if webhook_url:
+            await application.bot.set_webhook(
+                url=webhook_url.rstrip("/") + server.path,
+                secret_token=server.secret_token,
+                max_connections=max_connections,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        logger.info(f"Вебхук слушает http://{server.host}:{server.port}{server.path}")
+        await stop.wait()
+    finally:
+        await server.stop()
+        await application.stop()
+        if application.post_stop is not None:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown is not None:
+            await application.post_shutdown(application)
+
+
+def run(application, health=None):
+    """Запускает приложение в режиме вебхука с параметрами из переменных окружения (см. WebhookServer.from_env)."""
+    server = WebhookServer.from_env(application, health)
+    asyncio.run(serve(application, server, os.getenv("WEBHOOK_URL"),
+                      int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))))
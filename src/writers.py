@@ -0,0 +1,221 @@
+import csv
+import gzip
+import io
+import os
+import uuid
+from contextlib import contextmanager
+from decimal import Decimal
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font
+from openpyxl.utils import get_column_letter
+
+# Необязательные зависимости: без них форматы csv.zst и parquet недоступны
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Форматы файлов отчета; формат совпадает с расширением файла
+OUTPUT_FORMATS = ("xlsx", "csv", "csv.gz", "csv.zst", "parquet")
+
+# Сжатие для CSV-форматов
+CSV_COMPRESSION = {"csv": None, "csv.gz": "gzip", "csv.zst": "zstd"}
+
+# Уровни сжатия: стандартные для gzip и zstd, заметно быстрее максимальных при близком размере файла
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# Предельное число строк листа Excel вместе со строкой заголовка
+XLSX_MAX_ROWS = 1048576
+
+# Сколько строк собирается в одну группу строк Parquet
+PARQUET_BATCH_ROWS = 65536
+
+
+@contextmanager
+def atomic_output(path):
+    """
+    Выдает путь к временному файлу рядом с path и после успешной записи атомарно
+    переименовывает его в path. Читатель никогда не увидит наполовину записанный файл;
+    при ошибке временный файл удаляется, а прежний path остается нетронутым.
+    """
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, f".{name}.{uuid.uuid4().hex}.tmp")
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def available_formats():
+    """Форматы, доступные с установленными зависимостями."""
+    formats = [fmt for fmt in OUTPUT_FORMATS if fmt != "csv.zst" or zstandard is not None]
+    return [fmt for fmt in formats if fmt != "parquet" or pyarrow is not None]
+
+
+def write_rows(fmt, output_file, columns, rows, widths=None):
+    """
+    Записывает строки в файл формата fmt (см. OUTPUT_FORMATS).
+
+    :param widths: Ширины колонок, учитываются только для xlsx.
+    :return: Количество записанных строк данных.
+    """
+    if fmt == "xlsx":
+        return write_xlsx(output_file, columns, rows, widths)
+    if fmt == "parquet":
+        return write_parquet(output_file, columns, rows)
+    if fmt in CSV_COMPRESSION:
+        return write_csv(output_file, columns, rows, CSV_COMPRESSION[fmt])
+    raise ValueError(f"Неизвестный формат файла: {fmt}")
+
+
+@contextmanager
+def open_output(path, compression=None):
+    """
+    Открывает path на запись в двоичном режиме, при необходимости со сжатием.
+
+    :param compression: None, "gzip" или "zstd".
+    """
+    with open(path, "wb") as raw:
+        if compression is None:
+            yield raw
+        elif compression == "gzip":
+            # Имя и время в заголовке не пишутся: одинаковые данные дают одинаковый файл
+            with gzip.GzipFile(filename="", mode="wb", fileobj=raw, compresslevel=GZIP_LEVEL, mtime=0) as file:
+                yield file
+        elif compression == "zstd":
+            if zstandard is None:
+                raise RuntimeError("Для формата csv.zst нужен пакет zstandard.")
+            with zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(raw, closefd=False) as file:
+                yield file
+        else:
+            raise ValueError(f"Неизвестное сжатие: {compression}")
+
+
+def write_csv(output_file, columns, rows, compression=None):
+    """
+    Записывает строки в CSV-файл потоково, без накопления в памяти.
+
+    Файл начинается с BOM, чтобы Excel правильно распознал кириллицу в UTF-8.
+
+    :param compression: None, "gzip" или "zstd".
+    :return: Количество записанных строк данных.
+    """
+    count = 0
+    with open_output(output_file, compression) as binary:
+        text = io.TextIOWrapper(binary, encoding="utf-8-sig", newline="", write_through=False)
+        writer = csv.writer(text)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+        text.flush()
+        text.detach()
+    return count
+
+
+def write_parquet(output_file, columns, rows, batch_size=PARQUET_BATCH_ROWS):
+    """
+    Записывает строки в файл Parquet группами по batch_size строк.
+
+    Типы колонок определяются по первой группе строк; Decimal записывается как число
+    с плавающей точкой, колонка только из пустых значений — как строковая.
+
+    :return: Количество записанных строк данных.
+    """
+    if pyarrow is None:
+        raise RuntimeError("Для формата parquet нужен пакет pyarrow.")
+    writer = None
+    count = 0
+    try:
+        for batch in _batches(rows, batch_size):
+            table = _parquet_table(columns, batch, writer.schema if writer is not None else None)
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(output_file, table.schema)
+            writer.write_table(table)
+            count += table.num_rows
+        if writer is None:
+            # Пустой отчет: файл только с колонками
+            table = _parquet_table(columns, [], None)
+            writer = pyarrow.parquet.ParquetWriter(output_file, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+
+def _batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _parquet_table(columns, batch, schema):
+    values = [[float(value) if isinstance(value, Decimal) else value for value in column]
+              for column in (zip(*batch) if batch else [[] for _ in columns])]
+    if schema is not None:
+        arrays = []
+        for column, field in zip(values, schema):
+            if pyarrow.types.is_string(field.type):
+                column = [None if value is None else str(value) for value in column]
+            arrays.append(pyarrow.array(column, type=field.type))
+        return pyarrow.Table.from_arrays(arrays, schema=schema)
+    arrays = []
+    for column in values:
+        array = pyarrow.array(column)
+        arrays.append(array.cast(pyarrow.string()) if pyarrow.types.is_null(array.type) else array)
+    return pyarrow.Table.from_arrays(arrays, names=list(columns))
+
+
+def write_xlsx(output_file, columns, rows, widths=None):
+    """
+    Записывает строки в файл Excel за один проход.
+
+    Используется книга в режиме write_only: строки сразу сбрасываются на диск,
+    поэтому расход памяти не зависит от числа строк. Ширины колонок и
+    оформление заголовка задаются до записи данных.
+
+    :param output_file: Путь к файлу Excel.
+    :param columns: Названия колонок.
+    :param rows: Итерируемый источник строк (например, курсор или генератор).
+    :param widths: Ширины колонок в порядке columns.
+    :return: Количество записанных строк данных.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+
+    for col, width in enumerate(widths or [], start=1):
+        ws.column_dimensions[get_column_letter(col)].width = width
+
+    header_font = Font(bold=True)
+    header_alignment = Alignment(wrap_text=True, vertical="center")
+    header = []
+    for name in columns:
+        cell = WriteOnlyCell(ws, value=name)
+        cell.font = header_font
+        cell.alignment = header_alignment
+        header.append(cell)
+    ws.append(header)
+
+    count = 0
+    for row in rows:
+        ws.append(row)
+        count += 1
+
+    wb.save(output_file)
+    return count
@@ -0,0 +1,42 @@
+"""
+Общие части бенчмарков.
+
+Модуль бенчмарка помечается pytestmark = pytest.mark.bench("BENCH_..."): его тесты запускаются,
+только если переменная окружения задана. Результаты тесты складывают в фикстуру bench_results,
+а после тестов модуля она записывается в JSON-файл BENCH_OUTPUT модуля вместе с параметрами
+запуска BENCH_PARAMS.
+"""
+import json
+import os
+import platform
+from datetime import datetime
+import pytest
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "bench(env, reason=None): бенчмарк; запускается, только если задана env")
+
+
+def pytest_collection_modifyitems(config, items):
+    for item in items:
+        marker = item.get_closest_marker("bench")
+        if marker is not None and not os.getenv(marker.args[0]):
+            reason = marker.kwargs.get("reason") or f"{marker.args[0]} не задан"
+            item.add_marker(pytest.mark.skip(reason=reason))
+
+
+@pytest.fixture(scope="module")
+def bench_results(request):
+    """Словарь результатов бенчмарка модуля; записывается в файл request.module.BENCH_OUTPUT."""
+    results = {}
+    yield results
+    output = request.module.BENCH_OUTPUT
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        **getattr(request.module, "BENCH_PARAMS", {}),
+        "results": results,
+    }
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    print(f"Результаты бенчмарка записаны в {output}")
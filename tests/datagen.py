@@ -0,0 +1,108 @@
+"""
+Генератор синтетических данных о курьерах и заказах для бенчмарков.
+
+Заполняет таблицы couriers и orders в локальной PostgreSQL (параметры подключения
+берутся из тех же переменных окружения, что и у бота: HOST, PORT, USER_NAME, PASSWORD, DBNAME).
+Используйте отдельную пустую базу: таблицы очищаются перед загрузкой.
+
+Запуск из корня проекта:
+    python -m tests.datagen --couriers 200 --orders 100000
+"""
+import argparse
+import io
+import random
+from datetime import date, datetime, time, timedelta
+import psycopg2
+from src.db_pool import db_config_from_env
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS couriers (
+    courier_id BIGINT PRIMARY KEY,
+    courier_name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS orders (
+    order_id BIGSERIAL PRIMARY KEY,
+    courier_id BIGINT NOT NULL REFERENCES couriers (courier_id),
+    cur_time TIMESTAMP NOT NULL,
+    time_taken INTEGER
+);
+CREATE INDEX IF NOT EXISTS orders_cur_time_idx ON orders (cur_time);
+"""
+
+# Относительная нагрузка по часам суток: ночной минимум, пики в обед и вечером
+HOURLY_WEIGHTS = [1, 1, 1, 1, 1, 2, 4, 6, 8, 9, 10, 14, 18, 16, 11, 10, 11, 15, 20, 19, 14, 9, 5, 2]
+
+FIRST_NAMES = ["Иван", "Петр", "Сергей", "Алексей", "Дмитрий", "Андрей", "Мария", "Анна", "Ольга", "Елена"]
+LAST_NAMES = ["Иванов", "Петров", "Сидоров", "Смирнов", "Кузнецов", "Попов", "Соколов", "Лебедев"]
+
+
+def generate_rows(couriers, orders, day=None, seed=42):
+    """
+    Генерирует строки курьеров и заказов за день day.
+
+    Время заказа выбирается по профилю HOURLY_WEIGHTS, минута и секунда — равномерно.
+    Время ожидания — логнормальное (медиана около 10 минут), у части заказов отсутствует.
+
+    :return: (список (courier_id, courier_name), список (courier_id, cur_time, time_taken)).
+    """
+    rnd = random.Random(seed)
+    day = day or date.today()
+    day_start = datetime.combine(day, time())
+
+    courier_rows = [(i, f"{rnd.choice(LAST_NAMES)} {rnd.choice(FIRST_NAMES)} #{i}") for i in range(1, couriers + 1)]
+    # Курьеры работают с разной интенсивностью
+    activity = [rnd.paretovariate(2.0) for _ in courier_rows]
+
+    hours = rnd.choices(range(24), weights=HOURLY_WEIGHTS, k=orders)
+    courier_ids = rnd.choices([row[0] for row in courier_rows], weights=activity, k=orders)
+    order_rows = []
+    for hour, courier_id in zip(hours, courier_ids):
+        cur_time = day_start + timedelta(hours=hour, seconds=rnd.randrange(3600))
+        time_taken = None if rnd.random() < 0.01 else max(1, int(rnd.lognormvariate(2.3, 0.5)))
+        order_rows.append((courier_id, cur_time, time_taken))
+    return courier_rows, order_rows
+
+
+def _copy_rows(cursor, table, columns, rows):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join("\\N" if value is None else str(value) for value in row) + "\n")
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+def load(connection, couriers, orders, day=None, seed=42):
+    """
+    Пересоздает данные бенчмарка: очищает couriers, orders и почасовой агрегат и загружает новые строки.
+    """
+    courier_rows, order_rows = generate_rows(couriers, orders, day, seed)
+    with connection.cursor() as cursor:
+        cursor.execute(SCHEMA_SQL)
+        cursor.execute("DROP TABLE IF EXISTS courier_hourly_rollup, rollup_watermark")
+        cursor.execute("TRUNCATE orders, couriers RESTART IDENTITY")
+        _copy_rows(cursor, "couriers", ("courier_id", "courier_name"), courier_rows)
+        _copy_rows(cursor, "orders", ("courier_id", "cur_time", "time_taken"), order_rows)
+        cursor.execute("ANALYZE couriers")
+        cursor.execute("ANALYZE orders")
+    connection.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Загрузка синтетических данных курьеров и заказов.")
+    parser.add_argument("--couriers", type=int, default=200)
+    parser.add_argument("--orders", type=int, default=100000)
+    parser.add_argument("--day", type=date.fromisoformat, default=None,
+                        help="День заказов (YYYY-MM-DD), по умолчанию сегодня")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    connection = psycopg2.connect(**db_config_from_env())
+    try:
+        load(connection, args.couriers, args.orders, args.day, args.seed)
+    finally:
+        connection.close()
+    print(f"Загружено {args.couriers} курьеров и {args.orders} заказов.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Бенчмарк пути экспорта.
+
+Требует отдельную локальную PostgreSQL, параметры которой заданы в HOST, PORT, USER_NAME,
+PASSWORD, DBNAME (данные в couriers и orders будут перезаписаны). Запускается явно:
+
+    BENCH_DB=1 python -m pytest tests/test_benchmark.py -q
+
+Переменные окружения:
+    BENCH_SIZES     Число заказов через запятую, по умолчанию "10000,100000"
+    BENCH_COURIERS  Число курьеров, по умолчанию 200
+    BENCH_REPEAT    Повторов каждого замера, по умолчанию 5
+    BENCH_OUTPUT    Файл с результатами в JSON, по умолчанию bench_results.json
+"""
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from types import SimpleNamespace
+import pytest
+
+pytestmark = pytest.mark.bench("BENCH_DB", reason="BENCH_DB не задан: нужна отдельная PostgreSQL")
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+from src import bot_db, export  # noqa: E402
+from src.db_pool import db_config_from_env, execute_prepared, get_pool  # noqa: E402
+from src.report_cache import ReportCache  # noqa: E402
+from src.rollup import refresh_hourly_rollup  # noqa: E402
+from src.writers import write_xlsx  # noqa: E402
+from tests import datagen  # noqa: E402
+
+SIZES = [int(size) for size in os.getenv("BENCH_SIZES", "10000,100000").split(",")]
+COURIERS = int(os.getenv("BENCH_COURIERS", "200"))
+REPEAT = int(os.getenv("BENCH_REPEAT", "5"))
+BENCH_OUTPUT = os.getenv("BENCH_OUTPUT", "bench_results.json")
+BENCH_PARAMS = {"couriers": COURIERS}
+
+# Отчет за весь день покрывает все сгенерированные заказы
+ST_POINT, END_POINT = 0, 24
+
+
+def timed(func, repeat=REPEAT):
+    """Выполняет func repeat раз и возвращает сводку по времени в миллисекундах."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return {
+        "median_ms": round(statistics.median(samples), 3),
+        "min_ms": round(min(samples), 3),
+        "max_ms": round(max(samples), 3),
+        "repeat": repeat,
+    }
+
+
+@pytest.fixture(scope="module", params=SIZES, ids=lambda size: f"orders={size}")
+def dataset(request, bench_results):
+    connection = psycopg2.connect(**db_config_from_env())
+    try:
+        datagen.load(connection, COURIERS, request.param)
+    finally:
+        connection.close()
+    refresh_hourly_rollup()
+    bench_results.setdefault(str(request.param), {})
+    return request.param
+
+
+def test_export_stages(dataset, bench_results):
+    """Поэтапные замеры: подключение, запрос, выборка, запись файла и весь экспорт целиком."""
+    period_start, period_end = export.parse_period(f"{ST_POINT}-{END_POINT}")
+    params = (period_start, period_end)
+    stages = {}
+
+    stages["connect"] = timed(lambda: psycopg2.connect(**db_config_from_env()).close())
+
+    def checkout():
+        with get_pool().connection():
+            pass
+
+    stages["pool_checkout"] = timed(checkout)
+
+    def run_query(name, sql):
+        with get_pool().connection() as connection:
+            with connection.cursor() as cursor:
+                execute_prepared(cursor, name, sql, params)
+
+    stages["query_raw"] = timed(lambda: run_query("courier_totals", bot_db.COURIER_TOTALS_SQL))
+    stages["query_rollup"] = timed(lambda: run_query("courier_totals_rollup", bot_db.ROLLUP_TOTALS_SQL))
+
+    fetched = {}
+
+    def fetch():
+        with get_pool().connection() as connection:
+            with connection.cursor() as cursor:
+                execute_prepared(cursor, "courier_totals", bot_db.COURIER_TOTALS_SQL, params)
+                fetched["rows"] = bot_db.merge_courier_totals([cursor.fetchall()])
+
+    stages["query_fetch_and_merge"] = timed(fetch)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        output_file = os.path.join(tmp, "report.xlsx")
+        stages["xlsx_write_and_save"] = timed(
+            lambda: write_xlsx(output_file, bot_db.COURIER_REPORT_COLUMNS, fetched["rows"],
+                               bot_db.COURIER_REPORT_WIDTHS))
+        stages["fetch_courier_data_to_excel"] = timed(
+            lambda: bot_db.fetch_courier_data_to_excel(period_start, period_end, output_file))
+
+    stages["report_rows"] = len(fetched["rows"])
+    bench_results[str(dataset)]["stages"] = stages
+
+
+class FakeMessage:
+    """Минимальная замена telegram.Message для обработчиков бота."""
+
+    def __init__(self, text, chat_id=1):
+        self.text = text
+        self.chat_id = chat_id
+        self.replies = []
+        self.document_sent = asyncio.Event()
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+    async def reply_document(self, document, **kwargs):
+        # Строка — повторная отправка по file_id, без загрузки содержимого
+        if isinstance(document, str):
+            file_id = document
+        else:
+            document.read()
+            file_id = f"bench-{os.path.basename(document.name)}"
+        self.document_sent.set()
+        return SimpleNamespace(document=SimpleNamespace(file_id=file_id))
+
+
+class FakeUpdate:
+    def __init__(self, text, chat_id=1):
+        self.message = FakeMessage(text, chat_id)
+
+
+class FakeContext:
+    def __init__(self):
+        self.user_data = {"authenticated": True}
+        self.bot = None
+
+
+def test_end_to_end_latency(dataset, monkeypatch, bench_results):
+    """Задержка от сообщения с диапазоном до отправки файла: без кэша (cold) и с кэшем (warm)."""
+    pytest.importorskip("telegram")
+    import main
+
+    async def one_request():
+        update = FakeUpdate(f"{ST_POINT}-{END_POINT}")
+        started = time.perf_counter()
+        await main.get_st_and_end_points(update, FakeContext())
+        handler_ms = (time.perf_counter() - started) * 1000
+        await asyncio.wait_for(update.message.document_sent.wait(), timeout=300)
+        return handler_ms, (time.perf_counter() - started) * 1000
+
+    async def run(cold):
+        await main.export_queue.start()
+        try:
+            samples = []
+            for _ in range(REPEAT):
+                if cold:
+                    monkeypatch.setattr(export, "report_cache", ReportCache(export.report_store))
+                samples.append(await one_request())
+            return samples
+        finally:
+            await main.export_queue.stop()
+
+    latency = {}
+    for name, cold in (("cold", True), ("warm", False)):
+        samples = asyncio.run(run(cold))
+        latency[name] = {
+            "handler_median_ms": round(statistics.median(sample[0] for sample in samples), 3),
+            "delivery_median_ms": round(statistics.median(sample[1] for sample in samples), 3),
+            "delivery_max_ms": round(max(sample[1] for sample in samples), 3),
+            "repeat": REPEAT,
+        }
+    bench_results[str(dataset)]["end_to_end"] = latency
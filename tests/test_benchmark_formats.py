@@ -0,0 +1,60 @@
+"""
+Бенчмарк форматов файла отчета.
+
+Пишет синтетическую выгрузку заказов (те же колонки, что у режима detail) во все доступные
+форматы и замеряет время записи и размер файла. База данных не нужна. Запускается явно:
+
+    BENCH_FORMATS=1 python -m pytest tests/test_benchmark_formats.py -q -s
+
+Переменные окружения:
+    BENCH_SIZES            Число строк через запятую, по умолчанию "10000,100000"
+    BENCH_REPEAT           Повторов каждого замера, по умолчанию 3
+    BENCH_FORMATS_OUTPUT   Файл с результатами в JSON, по умолчанию bench_formats.json
+"""
+import os
+import statistics
+import tempfile
+import time
+import pytest
+
+pytestmark = pytest.mark.bench("BENCH_FORMATS")
+
+from src.bot_db import ORDERS_DETAIL_COLUMNS  # noqa: E402
+from src.writers import available_formats, write_rows  # noqa: E402
+from tests import datagen  # noqa: E402
+
+SIZES = [int(size) for size in os.getenv("BENCH_SIZES", "10000,100000").split(",")]
+REPEAT = int(os.getenv("BENCH_REPEAT", "3"))
+BENCH_OUTPUT = os.getenv("BENCH_FORMATS_OUTPUT", "bench_formats.json")
+
+
+def detail_rows(size):
+    """Строки в форме выгрузки заказов: (order_id, courier_id, courier_name, cur_time, time_taken)."""
+    courier_rows, order_rows = datagen.generate_rows(200, size)
+    names = dict(courier_rows)
+    return [(order_id, courier_id, names[courier_id], cur_time, time_taken)
+            for order_id, (courier_id, cur_time, time_taken) in enumerate(order_rows, start=1)]
+
+
+@pytest.mark.parametrize("size", SIZES, ids=lambda size: f"rows={size}")
+def test_write_formats(size, bench_results):
+    """Время записи и размер файла для каждого формата."""
+    rows = detail_rows(size)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for fmt in available_formats():
+            output_file = os.path.join(tmp, f"report.{fmt}")
+            samples = []
+            for _ in range(REPEAT):
+                started = time.perf_counter()
+                assert write_rows(fmt, output_file, ORDERS_DETAIL_COLUMNS, iter(rows)) == size
+                samples.append((time.perf_counter() - started) * 1000)
+            results[fmt] = {
+                "median_ms": round(statistics.median(samples), 3),
+                "min_ms": round(min(samples), 3),
+                "size_bytes": os.path.getsize(output_file),
+                "repeat": REPEAT,
+            }
+    bench_results[str(size)] = results
+    for fmt, result in results.items():
+        print(f"{size} строк, {fmt}: {result['median_ms']} мс, {result['size_bytes']} байт")
@@ -0,0 +1,182 @@
+"""
+Бенчмарк задержек цикла событий при потоке входящих сообщений.
+
+Обработчик take_message вызывается BENCH_MESSAGES раз подряд в цикле событий, как при
+потоке текстовых сообщений, а фоновая задача каждую миллисекунду засыпает и отмечает,
+на сколько позже запланированного она проснулась. Это опоздание и есть задержка, которую
+логирование добавляет к обработке остальных обновлений. Конфигурации:
+
+    sync        — прежняя: FileHandler('bot.log') и StreamHandler прямо в цикле событий
+    queue       — очередь с фоновой пакетной записью (src.logs), каждое сообщение в лог
+    queue_rate  — то же с выборочной записью сообщений (RateLimitFilter, 5 в секунду)
+
+База данных не нужна. Запускается явно:
+
+    BENCH_LOGGING=1 python -m pytest tests/test_benchmark_logging.py -q -s
+
+Переменные окружения:
+    BENCH_MESSAGES         Число сообщений, по умолчанию 20000
+    BENCH_LOG_STALL_MS     Имитация медленного диска: задержка одной записи в файл, по умолчанию 0
+    BENCH_LOG_STALL_EVERY  Какая по счету запись в файл задерживается, по умолчанию 100
+    BENCH_LOGGING_OUTPUT   Файл с результатами в JSON, по умолчанию bench_logging.json
+"""
+import asyncio
+import json
+import logging
+import os
+import queue
+import statistics
+import time
+from types import SimpleNamespace
+import pytest
+
+pytestmark = pytest.mark.bench("BENCH_LOGGING")
+
+MESSAGES = int(os.getenv("BENCH_MESSAGES", "20000"))
+STALL = float(os.getenv("BENCH_LOG_STALL_MS", "0")) / 1000
+STALL_EVERY = int(os.getenv("BENCH_LOG_STALL_EVERY", "100"))
+BENCH_OUTPUT = os.getenv("BENCH_LOGGING_OUTPUT", "bench_logging.json")
+BENCH_PARAMS = {"messages": MESSAGES, "stall_ms": STALL * 1000, "stall_every": STALL_EVERY}
+
+TICK = 0.001
+
+
+class SlowStream:
+    """Обертка файла, которая задерживает каждую STALL_EVERY-ю запись на STALL секунд."""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._writes = 0
+
+    def write(self, data):
+        self._writes += 1
+        if STALL and self._writes % STALL_EVERY == 0:
+            time.sleep(STALL)
+        return self._stream.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+@pytest.fixture(scope="module")
+def bot(tmp_path_factory):
+    pytest.importorskip("telegram")
+    os.environ.setdefault("TOKEN", "1:bench")
+    directory = tmp_path_factory.mktemp("logs")
+    os.environ["LOG_FILE"] = str(directory / "import.log")
+    os.environ["STATE_SQLITE_PATH"] = str(directory / "state.sqlite3")
+    import main
+    return main
+
+
+@pytest.fixture
+def root_handlers():
+    """Подменяет обработчики корневого логгера на время теста."""
+    root = logging.getLogger()
+    saved = root.handlers[:]
+    root.handlers.clear()
+    yield root
+    root.handlers[:] = saved
+
+
+def fake_update(i):
+    return SimpleNamespace(message=SimpleNamespace(chat_id=1000 + i % 50, text=f"сообщение номер {i}"))
+
+
+async def flood(take_message):
+    """Вызывает take_message MESSAGES раз; возвращает время потока и опоздания тикера в мс."""
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            planned = time.perf_counter() + TICK
+            await asyncio.sleep(TICK)
+            lags.append(max(0.0, time.perf_counter() - planned) * 1000)
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+    started = time.perf_counter()
+    for i in range(MESSAGES):
+        await take_message(fake_update(i), None)
+        # Между обновлениями цикл событий может выполнить другие задачи
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started
+    done.set()
+    await task
+    return elapsed, lags
+
+
+def summary(elapsed, lags):
+    lags = sorted(lags)
+    return {
+        "seconds": round(elapsed, 3),
+        "messages_per_second": round(MESSAGES / elapsed, 1),
+        "ticks": len(lags),
+        "stall_p50_ms": round(statistics.median(lags), 3),
+        "stall_p99_ms": round(lags[int(len(lags) * 0.99) - 1], 3),
+        "stall_max_ms": round(lags[-1], 3),
+    }
+
+
+def lines_written(path):
+    with open(path, encoding="utf-8") as file:
+        return file.readlines()
+
+
+def run(name, bot, results, rate=0):
+    from src.logs import RateLimitFilter
+
+    limiter = RateLimitFilter(rate, 20)
+    saved_filters = bot.message_logger.filters[:]
+    bot.message_logger.filters[:] = [limiter]
+    try:
+        elapsed, lags = asyncio.run(flood(bot.take_message))
+    finally:
+        bot.message_logger.filters[:] = saved_filters
+    results[name] = summary(elapsed, lags)
+    print(f"{name}: {results[name]}")
+
+
+def test_sync_logging(bot, root_handlers, tmp_path, bench_results):
+    """Прежняя настройка: запись в файл и консоль прямо в цикле событий."""
+    from src.logs import CONSOLE_FORMAT
+
+    file_handler = logging.FileHandler(tmp_path / "bot.log")
+    file_handler.stream = SlowStream(file_handler.stream)
+    console_handler = logging.StreamHandler(open(os.devnull, "w"))
+    for handler in (file_handler, console_handler):
+        handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+        root_handlers.addHandler(handler)
+    try:
+        run("sync", bot, bench_results)
+    finally:
+        file_handler.close()
+        console_handler.stream.close()
+    bench_results["sync"]["lines_written"] = len(lines_written(tmp_path / "bot.log"))
+
+
+@pytest.mark.parametrize("name, rate", [("queue", 0), ("queue_rate", 5)])
+def test_queue_logging(bot, root_handlers, tmp_path, name, rate, bench_results):
+    """Очередь с фоновой пакетной записью в JSON-файл с ротацией."""
+    from src.logs import CONSOLE_FORMAT, BatchRotatingFileHandler, JsonFormatter, LogWriter, NonBlockingQueueHandler
+
+    file_handler = BatchRotatingFileHandler(tmp_path / "bot.log", maxBytes=1024 ** 3, encoding="utf-8")
+    file_handler.setFormatter(JsonFormatter())
+    file_handler.stream = SlowStream(file_handler.stream)
+    console_handler = logging.StreamHandler(open(os.devnull, "w"))
+    console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+    log_queue = queue.Queue(10000)
+    writer = LogWriter(log_queue, [file_handler, console_handler])
+    writer.start()
+    root_handlers.addHandler(NonBlockingQueueHandler(log_queue))
+    try:
+        run(name, bot, bench_results, rate)
+    finally:
+        writer.stop()
+        file_handler.close()
+        console_handler.stream.close()
+    lines = lines_written(tmp_path / "bot.log")
+    assert lines and json.loads(lines[-1])["logger"] == "bot.messages"
+    # Остальные сообщения отброшены выборкой или из-за заполненной очереди
+    bench_results[name]["lines_written"] = len(lines)
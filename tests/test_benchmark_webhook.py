@@ -0,0 +1,253 @@
+"""
+Бенчмарк пропускной способности обработки обновлений: вебхук против опроса.
+
+Записанные обновления Telegram (tests/updates.json: /start, /export и /stats от нескольких
+пользователей) размножаются до BENCH_UPDATES штук и доставляются боту двумя способами:
+POST-запросами на локальный WebhookServer и через getUpdates при обычном опросе.
+Вместо api.telegram.org бот обращается к локальной заглушке Bot API (TELEGRAM_API_URL),
+поэтому замер показывает накладные расходы самого бота без сетевых задержек до Telegram.
+База данных не нужна. Запускается явно:
+
+    BENCH_WEBHOOK=1 python -m pytest tests/test_benchmark_webhook.py -q -s
+
+Переменные окружения:
+    BENCH_UPDATES          Число обновлений, по умолчанию 3000
+    BENCH_CLIENTS          Число параллельных соединений к вебхуку, по умолчанию 8
+    BENCH_CHATS            Сколько разных пользователей отправляют обновления, по умолчанию 50
+    BENCH_API_LATENCY_MS   Искусственная задержка ответа заглушки на sendMessage, по умолчанию 0
+    BENCH_WEBHOOK_OUTPUT   Файл с результатами в JSON, по умолчанию bench_webhook.json
+"""
+import asyncio
+import http.client
+import json
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import pytest
+
+pytestmark = pytest.mark.bench("BENCH_WEBHOOK")
+
+UPDATES = int(os.getenv("BENCH_UPDATES", "3000"))
+CLIENTS = int(os.getenv("BENCH_CLIENTS", "8"))
+CHATS = int(os.getenv("BENCH_CHATS", "50"))
+API_LATENCY = float(os.getenv("BENCH_API_LATENCY_MS", "0")) / 1000
+BENCH_OUTPUT = os.getenv("BENCH_WEBHOOK_OUTPUT", "bench_webhook.json")
+BENCH_PARAMS = {
+    "updates": UPDATES,
+    "clients": CLIENTS,
+    "chats": CHATS,
+    "api_latency_ms": API_LATENCY * 1000,
+    "update_concurrency": int(os.getenv("UPDATE_CONCURRENCY", "8")),
+}
+
+RECORDED = os.path.join(os.path.dirname(__file__), "updates.json")
+
+
+class FakeBotApi:
+    """
+    Заглушка Bot API: отвечает на getMe, sendMessage, getUpdates и методы управления вебхуком.
+
+    getUpdates отдает обновления из self.updates, начиная с offset, после вызова release().
+    """
+
+    def __init__(self):
+        self.updates = []
+        self.sent = 0
+        self.all_sent = threading.Event()
+        self.expected = None
+        self._released = threading.Event()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, name="fake-bot-api", daemon=True).start()
+
+    def reset(self, updates, expected):
+        self.updates = updates
+        self.sent = 0
+        self.expected = expected
+        self.all_sent.clear()
+        self._released.clear()
+
+    def release(self):
+        self._released.set()
+
+    def close(self):
+        self._server.shutdown()
+
+    def _call(self, method, params):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        if method == "sendMessage":
+            # Имитация сетевой задержки до настоящего Bot API
+            time.sleep(API_LATENCY)
+            with self._lock:
+                self.sent += 1
+                if self.sent == self.expected:
+                    self.all_sent.set()
+            chat_id = int(params["chat_id"])
+            return {"message_id": 1, "date": 0, "chat": {"id": chat_id, "type": "private"}, "text": params["text"]}
+        if method == "getUpdates":
+            if not self._released.wait(timeout=0.1):
+                return []
+            offset = int(params.get("offset") or 0)
+            limit = int(params.get("limit") or 100)
+            pending = [update for update in self.updates if update["update_id"] >= offset][:limit]
+            if not pending:
+                time.sleep(0.05)
+            return pending
+        return True
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Заголовки и тело уходят одним пакетом: без этого Nagle и отложенный ACK добавляют ~40 мс на запрос
+            disable_nagle_algorithm = True
+            wbufsize = -1
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    params = json.loads(body or "{}")
+                else:
+                    params = {key: values[0] for key, values in parse_qs(body).items()}
+                method = self.path.rsplit("/", 1)[-1]
+                payload = json.dumps({"ok": True, "result": api._call(method, params)}).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                try:
+                    self.wfile.write(payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    # Бот закрыл длинный опрос при остановке
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def recorded_updates(count):
+    """
+    Записанные обновления, размноженные до count штук с уникальными update_id
+    и распределенные между CHATS пользователями.
+    """
+    with open(RECORDED, encoding="utf-8") as file:
+        recorded = json.load(file)
+    updates = []
+    for i in range(count):
+        update = json.loads(json.dumps(recorded[i % len(recorded)]))
+        update["update_id"] = i + 1
+        update["message"]["message_id"] = i + 1
+        # Обновления одного чата обрабатываются по очереди, поэтому число чатов ограничивает параллельность
+        user_id = update["message"]["from"]["id"] + i % CHATS
+        update["message"]["from"]["id"] = update["message"]["chat"]["id"] = user_id
+        updates.append(update)
+    return updates
+
+
+@pytest.fixture(scope="module")
+def bot_api():
+    api = FakeBotApi()
+    yield api
+    api.close()
+
+
+@pytest.fixture
+def application(bot_api, monkeypatch):
+    pytest.importorskip("telegram")
+    monkeypatch.setenv("TOKEN", "1:bench")
+    monkeypatch.setenv("TELEGRAM_API_URL", bot_api.url)
+    import main
+    return main.build_application()
+
+
+def post_updates(port, path, updates):
+    """Отправляет обновления POST-запросами по одному keep-alive соединению; возвращает задержки в мс."""
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    latencies = []
+    try:
+        for update in updates:
+            body = json.dumps(update).encode("utf-8")
+            started = time.perf_counter()
+            connection.request("POST", path, body, {"Content-Type": "application/json"})
+            response = connection.getresponse()
+            response.read()
+            assert response.status == 200
+            latencies.append((time.perf_counter() - started) * 1000)
+    finally:
+        connection.close()
+    return latencies
+
+
+def summary(elapsed, latencies=None):
+    result = {"seconds": round(elapsed, 3), "updates_per_second": round(UPDATES / elapsed, 1)}
+    if latencies:
+        latencies = sorted(latencies)
+        result["request_p50_ms"] = round(statistics.median(latencies), 3)
+        result["request_p99_ms"] = round(latencies[int(len(latencies) * 0.99) - 1], 3)
+    return result
+
+
+def test_webhook_throughput(application, bot_api, bench_results):
+    """Обновления, отправленные POST-запросами на локальный вебхук из CLIENTS соединений."""
+    from src.webhook import WebhookServer
+
+    updates = recorded_updates(UPDATES)
+    bot_api.reset([], UPDATES)
+
+    async def run():
+        server = WebhookServer(application, port=0, max_pending=UPDATES)
+        await application.initialize()
+        await application.start()
+        await server.start()
+        try:
+            loop = asyncio.get_running_loop()
+            shards = [updates[i::CLIENTS] for i in range(CLIENTS)]
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=CLIENTS) as executor:
+                results = await asyncio.gather(*(
+                    loop.run_in_executor(executor, post_updates, server.port, server.path, shard) for shard in shards))
+            elapsed = time.perf_counter() - started
+        finally:
+            await server.stop()
+            await application.stop()
+            await application.shutdown()
+        return elapsed, [latency for result in results for latency in result]
+
+    elapsed, latencies = asyncio.run(run())
+    assert bot_api.sent == UPDATES
+    bench_results["webhook"] = summary(elapsed, latencies)
+    print(f"webhook: {bench_results['webhook']}")
+
+
+def test_polling_throughput(application, bot_api, bench_results):
+    """Те же обновления, полученные через getUpdates."""
+    bot_api.reset(recorded_updates(UPDATES), UPDATES)
+
+    async def run():
+        await application.initialize()
+        await application.updater.start_polling(poll_interval=0, timeout=1)
+        await application.start()
+        try:
+            started = time.perf_counter()
+            bot_api.release()
+            await asyncio.get_running_loop().run_in_executor(None, bot_api.all_sent.wait, 300)
+            elapsed = time.perf_counter() - started
+        finally:
+            await application.updater.stop()
+            await application.stop()
+            await application.shutdown()
+        return elapsed
+
+    elapsed = asyncio.run(run())
+    assert bot_api.sent == UPDATES
+    bench_results["polling"] = summary(elapsed)
+    print(f"polling: {bench_results['polling']}")
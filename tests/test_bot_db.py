@@ -0,0 +1,51 @@
+"""Деление периода по суткам и сложение частичных итогов по курьерам."""
+from datetime import datetime
+from decimal import Decimal
+from src.bot_db import merge_courier_totals, split_by_day
+
+
+def test_split_within_day():
+    period = (datetime(2024, 10, 1, 14), datetime(2024, 10, 1, 17))
+    assert split_by_day(*period) == [period]
+
+
+def test_split_across_days():
+    assert split_by_day(datetime(2024, 10, 1, 20), datetime(2024, 10, 3, 2)) == [
+        (datetime(2024, 10, 1, 20), datetime(2024, 10, 2)),
+        (datetime(2024, 10, 2), datetime(2024, 10, 3)),
+        (datetime(2024, 10, 3), datetime(2024, 10, 3, 2)),
+    ]
+
+
+def test_split_empty_period():
+    assert split_by_day(datetime(2024, 10, 1), datetime(2024, 10, 1)) == []
+
+
+def test_merge_exact_average_over_parts():
+    # Среднее считается по сумме частей, а не как среднее средних: (10 + 1) / (2 + 1)
+    report = merge_courier_totals([[(1, "Иванов", 2, 10)], [(1, "Иванов", 1, 1)]])
+    assert report == [(1, "Иванов", 3, 11, Decimal("3.67"))]
+
+
+def test_merge_rounds_half_up():
+    # 0.125 и 0.375 при округлении до двух знаков половина уходит вверх, как ROUND в PostgreSQL
+    report = merge_courier_totals([[(1, "А", 8, Decimal("1")), (2, "Б", 8, Decimal("3"))]])
+    assert [row[4] for row in report] == [Decimal("0.38"), Decimal("0.13")]
+
+
+def test_merge_null_totals_first():
+    # Курьер без времени ожидания: сумма и среднее NULL, строка идет первой, как NULL при ORDER BY DESC
+    report = merge_courier_totals([
+        [(1, "А", 2, Decimal("4")), (2, "Б", 1, None)],
+        [(2, "Б", 3, None), (3, "В", 1, Decimal("9"))],
+    ])
+    assert report == [
+        (2, "Б", 4, None, None),
+        (3, "В", 1, Decimal("9"), Decimal("9.00")),
+        (1, "А", 2, Decimal("4"), Decimal("2.00")),
+    ]
+
+
+def test_merge_null_part_keeps_known_total():
+    report = merge_courier_totals([[(1, "А", 1, None)], [(1, "А", 1, Decimal("5"))]])
+    assert report == [(1, "А", 2, Decimal("5"), Decimal("2.50"))]
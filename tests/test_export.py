@@ -0,0 +1,102 @@
+"""Разбор периода отчета, имена файлов отчетов, окончательность готовых файлов и блокировки сборки."""
+import threading
+import time
+from datetime import date, datetime, timedelta
+import pytest
+from src import export
+from src.export import MAX_PERIOD_DAYS, parse_period
+from src.report_cache import REPORT_VERSION, ReportCache, report_file_name, report_key
+from src.rollup import ROLLUP_LAG_MINUTES
+
+TODAY = date(2024, 10, 7)
+
+
+def test_hours_of_today():
+    assert parse_period("14-17", today=TODAY) == (datetime(2024, 10, 7, 14), datetime(2024, 10, 7, 17))
+
+
+def test_hours_of_given_day():
+    assert parse_period(" 2024-10-01 8-24 ", today=TODAY) == (datetime(2024, 10, 1, 8), datetime(2024, 10, 2))
+
+
+def test_day_range_includes_last_day():
+    assert parse_period("2024-10-01..2024-10-03", today=TODAY) == (datetime(2024, 10, 1), datetime(2024, 10, 4))
+
+
+def test_day_range_with_hours():
+    assert parse_period("2024-10-01 08..2024-10-03 20", today=TODAY) == (
+        datetime(2024, 10, 1, 8), datetime(2024, 10, 3, 20))
+
+
+@pytest.mark.parametrize("text", ["", "14", "17-14", "14-14", "2024-10-03..2024-10-01", "2024-10-01 8..2024-10-01 8",
+                                  "вчера", "2024-13-01 14-17"])
+def test_invalid_period(text):
+    with pytest.raises(ValueError):
+        parse_period(text, today=TODAY)
+
+
+def test_period_length_limit():
+    start = datetime(2024, 1, 1)
+    longest = start + timedelta(days=MAX_PERIOD_DAYS)
+    assert parse_period(f"{start:%Y-%m-%d}..{longest - timedelta(days=1):%Y-%m-%d}") == (start, longest)
+    with pytest.raises(ValueError):
+        parse_period(f"{start:%Y-%m-%d}..{longest:%Y-%m-%d}")
+
+
+def test_file_name_within_day():
+    key = report_key(datetime(2024, 10, 1, 14), datetime(2024, 10, 1, 17))
+    assert report_file_name(key) == f"courier_data_14-17_2024-10-01_v{REPORT_VERSION}.xlsx"
+
+
+def test_file_name_until_midnight():
+    key = report_key(datetime(2024, 10, 1, 20), datetime(2024, 10, 2), kind="detail")
+    assert report_file_name(key) == f"orders_20-24_2024-10-01_v{REPORT_VERSION}.csv"
+
+
+def test_file_name_multi_day_with_format():
+    key = report_key(datetime(2024, 10, 1, 8), datetime(2024, 10, 7, 20), fmt="csv.gz")
+    assert report_file_name(key) == f"courier_data_2024-10-01_08-2024-10-07_20_v{REPORT_VERSION}.csv.gz"
+
+
+class FakeStore:
+    def __init__(self, mtime):
+        self.mtime = mtime
+
+    def lookup(self, name):
+        return {"size": 1, "mtime": self.mtime}
+
+
+def test_report_read_before_rollup_lag_is_not_final():
+    # Заказы фиксируются с опозданием до ROLLUP_LAG_MINUTES, поэтому отчет, собранный через минуту
+    # после конца периода, перепроверяется
+    period_end = datetime(2024, 10, 1, 17)
+    read_started = period_end + timedelta(minutes=1)
+    assert not ReportCache(FakeStore(read_started.timestamp())).is_final("report.xlsx", period_end)
+
+
+def test_report_read_after_rollup_lag_is_final():
+    period_end = datetime(2024, 10, 1, 17)
+    read_started = period_end + timedelta(minutes=ROLLUP_LAG_MINUTES)
+    assert ReportCache(FakeStore(read_started.timestamp())).is_final("report.xlsx", period_end)
+
+
+def test_build_lock_serializes_and_is_released():
+    key = ("couriers", "xlsx", datetime(2024, 10, 1, 14), datetime(2024, 10, 1, 17), REPORT_VERSION)
+    inside = []
+    most = []
+
+    def build():
+        with export._build_lock(key):
+            inside.append(1)
+            most.append(len(inside))
+            time.sleep(0.05)
+            inside.pop()
+
+    threads = [threading.Thread(target=build) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert most == [1, 1, 1]
+    # Запись о блокировке удаляется после последнего потока и не копится по ключам отчетов
+    assert key not in export._build_locks
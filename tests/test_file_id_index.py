@@ -0,0 +1,53 @@
+"""Индекс file_id отправленных отчетов в общем хранилище состояния."""
+import os
+from src.file_id_index import FileIdIndex
+from src.state_store import SQLiteStateStore
+
+
+def make_indexes(tmp_path, count=2):
+    # Разные процессы бота открывают один и тот же файл хранилища
+    return [FileIdIndex(SQLiteStateStore(str(tmp_path / "state.sqlite3"))) for _ in range(count)]
+
+
+def write(path, data):
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_entries_shared_between_processes(tmp_path):
+    first, second = make_indexes(tmp_path)
+    a = write(tmp_path / "a.xlsx", b"a")
+    b = write(tmp_path / "b.xlsx", b"b")
+    first.store("a.xlsx", a, "file-a")
+    second.store("b.xlsx", b, "file-b")
+    # Запись одного процесса не затирает записи другого
+    assert first.lookup("b.xlsx", b) == "file-b"
+    assert second.lookup("a.xlsx", a) == "file-a"
+
+
+def test_same_content_rebuilt_keeps_file_id(tmp_path):
+    index, = make_indexes(tmp_path, 1)
+    path = write(tmp_path / "a.xlsx", b"report")
+    index.store("a.xlsx", path, "file-a")
+    os.utime(path, (1, 1))
+    assert index.lookup("a.xlsx", path) == "file-a"
+
+
+def test_changed_content_invalidates(tmp_path):
+    index, = make_indexes(tmp_path, 1)
+    path = write(tmp_path / "a.xlsx", b"report")
+    index.store("a.xlsx", path, "file-a")
+    write(tmp_path / "a.xlsx", b"new report")
+    assert index.lookup("a.xlsx", path) is None
+    write(tmp_path / "a.xlsx", b"report")
+    assert index.lookup("a.xlsx", path) is None
+
+
+def test_missing_file_is_a_miss(tmp_path):
+    index, = make_indexes(tmp_path, 1)
+    path = write(tmp_path / "a.xlsx", b"report")
+    index.store("a.xlsx", path, "file-a")
+    os.remove(path)
+    assert index.lookup("a.xlsx", path) is None
+    index.store("b.xlsx", path, "file-b")
+    assert index.lookup("b.xlsx", path) is None
@@ -0,0 +1,182 @@
+"""Очередь заданий экспорта: лимиты, позиция в очереди, обработчики завершения и объединение запросов."""
+import asyncio
+import threading
+import pytest
+from src.jobs import ExportQueue, ExportQueueFull, UserLimitExceeded
+
+
+def double(x):
+    return x * 2
+
+
+def fail(x):
+    raise ValueError(f"ошибка {x}")
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, timeout=5))
+
+
+async def started_queue(**kwargs):
+    export_queue = ExportQueue(**kwargs)
+    await export_queue.start()
+    return export_queue
+
+
+def collector():
+    """Обработчик завершения, который складывает (result, error) в список и отмечает вызов событием."""
+    calls = []
+    done = asyncio.Event()
+
+    async def on_done(result, error):
+        calls.append((result, error))
+        done.set()
+
+    on_done.calls = calls
+    on_done.done = done
+    return on_done
+
+
+def test_result_and_error_passed_to_on_done():
+    async def scenario():
+        export_queue = await started_queue(workers=1)
+        ok, failed = collector(), collector()
+        export_queue.submit(1, double, [21], ok)
+        export_queue.submit(2, fail, [1], failed)
+        await ok.done.wait()
+        await failed.done.wait()
+        await export_queue.stop()
+        return ok.calls, failed.calls
+
+    ok, failed = run(scenario())
+    assert ok == [(42, None)]
+    assert failed[0][0] is None and isinstance(failed[0][1], ValueError)
+
+
+def test_position_and_depth():
+    async def scenario():
+        export_queue = await started_queue(workers=1, max_size=5)
+        # Воркеры еще не получили управление, поэтому все задания ждут в очереди
+        positions = [export_queue.submit(user_id, double, [user_id], collector()) for user_id in range(3)]
+        depth = export_queue.depth
+        await export_queue.stop()
+        return positions, depth
+
+    assert run(scenario()) == ([1, 2, 3], 3)
+
+
+def test_queue_full():
+    async def scenario():
+        export_queue = await started_queue(workers=1, max_size=2)
+        export_queue.submit(1, double, [1], collector())
+        export_queue.submit(2, double, [2], collector())
+        try:
+            with pytest.raises(ExportQueueFull):
+                export_queue.submit(3, double, [3], collector())
+        finally:
+            await export_queue.stop()
+
+    run(scenario())
+
+
+def test_per_user_limit_released_after_job():
+    async def scenario():
+        export_queue = await started_queue(workers=1, per_user_limit=1)
+        first = collector()
+        export_queue.submit(1, double, [1], first)
+        with pytest.raises(UserLimitExceeded):
+            export_queue.submit(1, double, [2], collector())
+        # Другой пользователь лимитом не затронут
+        export_queue.submit(2, double, [3], collector())
+        await first.done.wait()
+        position = export_queue.submit(1, double, [2], collector())
+        await export_queue.stop()
+        return position
+
+    assert run(scenario()) >= 1
+
+
+def test_identical_jobs_coalesced():
+    calls = []
+
+    def counted(x):
+        calls.append(x)
+        return x + 1
+
+    async def scenario():
+        export_queue = await started_queue(workers=1, per_user_limit=1)
+        handlers = [collector() for _ in range(3)]
+        positions = [export_queue.submit(user_id, counted, [10], on_done) for user_id, on_done in enumerate(handlers)]
+        for on_done in handlers:
+            await on_done.done.wait()
+        await export_queue.stop()
+        return positions, [on_done.calls for on_done in handlers]
+
+    positions, results = run(scenario())
+    assert positions == [1, 0, 0]
+    assert results == [[(11, None)]] * 3
+    assert calls == [10]
+
+
+def test_slow_on_done_does_not_block_worker():
+    async def scenario():
+        export_queue = await started_queue(workers=1)
+        release = asyncio.Event()
+        second = collector()
+
+        async def slow(result, error):
+            await release.wait()
+
+        export_queue.submit(1, double, [1], slow)
+        export_queue.submit(2, double, [2], second)
+        # Если бы воркер ждал обработчик первого задания, второе не выполнилось бы
+        await second.done.wait()
+        release.set()
+        await export_queue.stop()
+        return second.calls
+
+    assert run(scenario()) == [(4, None)]
+
+
+def test_stop_cancels_pending_on_done():
+    async def scenario():
+        export_queue = await started_queue(workers=1)
+        entered = asyncio.Event()
+        cancelled = []
+
+        async def hanging(result, error):
+            entered.set()
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                cancelled.append(result)
+                raise
+
+        export_queue.submit(1, double, [5], hanging)
+        await entered.wait()
+        await export_queue.stop()
+        return cancelled, export_queue.running
+
+    assert run(scenario()) == ([10], 0)
+
+
+def test_stop_does_not_wait_for_queued_jobs():
+    started = threading.Event()
+    release = threading.Event()
+
+    def blocking(x):
+        started.set()
+        release.wait(5)
+        return x
+
+    async def scenario():
+        export_queue = await started_queue(workers=1)
+        never = collector()
+        export_queue.submit(1, blocking, [1], collector())
+        export_queue.submit(2, double, [2], never)
+        await asyncio.to_thread(started.wait, 5)
+        await export_queue.stop()
+        release.set()
+        return never.calls
+
+    assert run(scenario()) == []
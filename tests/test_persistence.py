@@ -0,0 +1,76 @@
+"""Подтягивание состояния диалога из общего хранилища (внутреннее API python-telegram-bot)."""
+import asyncio
+from types import SimpleNamespace
+import pytest
+
+telegram = pytest.importorskip("telegram")
+
+from telegram import Update  # noqa: E402
+from telegram.ext import CommandHandler  # noqa: E402
+from src.persistence import PTB_TESTED_VERSION, SharedConversationHandler  # noqa: E402
+
+CHAT_ID = 42
+
+
+class FakeStore:
+    def __init__(self, state):
+        self.state = state
+        self.requested = []
+
+    def load_conversation(self, name, key):
+        self.requested.append((name, key))
+        return self.state
+
+
+class FakePersistence:
+    async def get_conversations(self, name):
+        return {}
+
+
+async def noop(update, context):
+    return None
+
+
+def make_handler(persistent=True):
+    handler = SharedConversationHandler(name="export", persistent=persistent,
+                                        entry_points=[CommandHandler("export", noop)],
+                                        states={0: [CommandHandler("cancel", noop)]}, fallbacks=[])
+    if persistent:
+        # Так приложение подключает хранилище к диалогу при запуске
+        asyncio.run(handler._initialize_persistence(SimpleNamespace(persistence=FakePersistence())))
+    return handler
+
+
+def make_update():
+    user = {"id": CHAT_ID, "is_bot": False, "first_name": "Тест"}
+    return Update.de_json({"update_id": 1, "message": {
+        "message_id": 1, "date": 0, "chat": {"id": CHAT_ID, "type": "private"}, "from": user, "text": "14-17"}}, None)
+
+
+def test_tested_version_is_installed():
+    # Версия закреплена в pyproject.toml; при ее обновлении нужно перепроверить SharedConversationHandler
+    assert telegram.__version__ == PTB_TESTED_VERSION
+
+
+def test_stored_state_replaces_local_state():
+    handler = make_handler()
+    store = FakeStore(0)
+    asyncio.run(handler.refresh_state(make_update(), store))
+    assert store.requested == [("export", (CHAT_ID, CHAT_ID))]
+    assert handler._local_state((CHAT_ID, CHAT_ID)) == 0
+    assert (CHAT_ID, CHAT_ID) in handler._conversations
+    # Состояние, прочитанное из хранилища, не записывается в него повторно
+    assert not handler._conversations.pop_accessed_write_items()
+
+
+def test_finished_conversation_removed():
+    handler = make_handler()
+    asyncio.run(handler.refresh_state(make_update(), FakeStore(0)))
+    asyncio.run(handler.refresh_state(make_update(), FakeStore(None)))
+    assert (CHAT_ID, CHAT_ID) not in handler._conversations
+
+
+def test_not_persistent_handler_is_not_refreshed():
+    store = FakeStore(0)
+    asyncio.run(make_handler(persistent=False).refresh_state(make_update(), store))
+    assert store.requested == []
@@ -0,0 +1,147 @@
+"""Хранилище готовых отчетов: индекс, удаление по возрасту и давности обращения, закрепленные файлы."""
+import os
+import time
+from src.report_store import STALE_TMP_SECONDS, ReportStore
+
+HOUR = 3600
+
+
+def write(store, name, size=10, age=0):
+    path = store.path(name)
+    with open(path, "wb") as file:
+        file.write(b"x" * size)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def make_store(tmp_path, max_bytes=10 ** 6, max_age=24 * HOUR):
+    return ReportStore(str(tmp_path), max_bytes=max_bytes, max_age=max_age)
+
+
+def test_scan_indexes_existing_reports(tmp_path):
+    (tmp_path / "a.xlsx").write_bytes(b"abc")
+    (tmp_path / ".b.xlsx.tmp").write_bytes(b"partial")
+    store = make_store(tmp_path)
+    assert store.lookup("a.xlsx")["size"] == 3
+    assert store.stats() == {"files": 1, "bytes": 3, "in_use": 0}
+
+
+def test_lookup_missing_report(tmp_path):
+    assert make_store(tmp_path).lookup("a.xlsx") is None
+
+
+def test_add_and_lookup(tmp_path):
+    store = make_store(tmp_path)
+    write(store, "a.xlsx", size=5)
+    store.add("a.xlsx")
+    entry = store.lookup("a.xlsx")
+    assert entry["size"] == 5
+    assert entry["mtime"] == os.path.getmtime(store.path("a.xlsx"))
+
+
+def test_evicts_reports_older_than_max_age(tmp_path):
+    store = make_store(tmp_path, max_age=HOUR)
+    write(store, "old.xlsx", age=2 * HOUR)
+    write(store, "new.xlsx")
+    store.add("old.xlsx")
+    store.add("new.xlsx")
+    assert not os.path.exists(store.path("old.xlsx"))
+    assert store.lookup("old.xlsx") is None
+    assert store.lookup("new.xlsx") is not None
+
+
+def test_evicts_least_recently_used_over_budget(tmp_path):
+    store = make_store(tmp_path)
+    for age, name in enumerate(["c.xlsx", "b.xlsx", "a.xlsx"]):
+        write(store, name, size=10, age=age * 60)
+        store.add(name)
+    store.max_bytes = 25
+    # a.xlsx — самый старый, но к нему только что обращались; удаляется b.xlsx
+    store.lookup("a.xlsx")
+    assert store.enforce() == ["b.xlsx"]
+    assert sorted(os.listdir(tmp_path)) == ["a.xlsx", "c.xlsx"]
+    assert store.stats()["bytes"] == 20
+
+
+def test_pinned_report_is_not_evicted(tmp_path):
+    store = make_store(tmp_path, max_bytes=0, max_age=HOUR)
+    write(store, "a.xlsx", age=2 * HOUR)
+    with store.in_use("a.xlsx") as path:
+        assert path == store.path("a.xlsx")
+        store.add("a.xlsx")
+        assert store.enforce() == []
+        assert store.stats()["in_use"] == 1
+    assert store.enforce() == ["a.xlsx"]
+    assert store.stats() == {"files": 0, "bytes": 0, "in_use": 0}
+
+
+def test_remove_stale_tmp(tmp_path):
+    store = make_store(tmp_path)
+    write(store, ".old.xlsx.tmp", age=STALE_TMP_SECONDS + 60)
+    write(store, ".fresh.xlsx.tmp")
+    write(store, "report.xlsx", age=STALE_TMP_SECONDS + 60)
+    store.remove_stale_tmp()
+    assert sorted(os.listdir(tmp_path)) == [".fresh.xlsx.tmp", "report.xlsx"]
+
+
+class SharedPins:
+    """Общее хранилище состояния с закреплениями других процессов."""
+
+    def __init__(self, pinned=(), fail=False):
+        self.pinned = set(pinned)
+        self.fail = fail
+
+    def pin_report(self, name, ttl):
+        return "owner"
+
+    def unpin_report(self, name, owner):
+        pass
+
+    def pinned_reports(self):
+        if self.fail:
+            raise OSError("хранилище недоступно")
+        return self.pinned
+
+
+def test_lookup_uses_index_without_disk(tmp_path, monkeypatch):
+    store = make_store(tmp_path)
+    write(store, "a.xlsx")
+    store.add("a.xlsx")
+
+    def no_stat(path):
+        raise AssertionError("поиск по индексу не должен обращаться к диску")
+
+    monkeypatch.setattr(os, "stat", no_stat)
+    assert store.lookup("a.xlsx") is not None
+
+
+def test_shared_mode_only_by_configuration(tmp_path, monkeypatch):
+    monkeypatch.delenv("REPORT_STORE_SHARED", raising=False)
+    assert ReportStore.from_env(str(tmp_path), state_store=SharedPins).state_store is None
+    monkeypatch.setenv("REPORT_STORE_SHARED", "1")
+    assert ReportStore.from_env(str(tmp_path), state_store=SharedPins).state_store is SharedPins
+
+
+def test_shared_lookup_sees_removal_by_other_process(tmp_path):
+    store = ReportStore(str(tmp_path), max_bytes=10 ** 6, max_age=HOUR, state_store=SharedPins)
+    os.remove(write(store, "a.xlsx"))
+    assert store.lookup("a.xlsx") is None
+
+
+def test_report_pinned_by_other_process_is_not_evicted(tmp_path):
+    shared = SharedPins(pinned={"a.xlsx"})
+    store = ReportStore(str(tmp_path), max_bytes=0, max_age=HOUR, state_store=lambda: shared)
+    write(store, "a.xlsx", age=2 * HOUR)
+    write(store, "b.xlsx", age=2 * HOUR)
+    store._scan()
+    assert store.enforce() == ["b.xlsx"]
+
+
+def test_eviction_skipped_when_shared_pins_unknown(tmp_path):
+    shared = SharedPins(fail=True)
+    store = ReportStore(str(tmp_path), max_bytes=0, max_age=HOUR, state_store=lambda: shared)
+    write(store, "a.xlsx", age=2 * HOUR)
+    store._scan()
+    assert store.enforce() == []
+    assert os.path.exists(store.path("a.xlsx"))